@@ -2,11 +2,10 @@ from flask import Flask
 from config import Config
 from flask_bootstrap import Bootstrap
 from flask_login import LoginManager
-from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_caching import Cache
 from flask_mail import Mail
-import flask_profiler
+from app.database import Database
 
 import logging
 from logging.handlers import RotatingFileHandler
@@ -17,26 +16,12 @@ app.config.from_object(Config)
 bootstrap = Bootstrap(app)
 login = LoginManager(app)
 login.login_view = 'login'
-db = SQLAlchemy(app)
+db = Database(app)
 migrate = Migrate(app, db)
 app.jinja_env.trim_blocks=True
 app.jinja_env.lstrip_blocks=True
 cache = Cache(app, config={'CACHE_TYPE': 'filesystem', 'CACHE_DIR': 'cache'})
 mail = Mail(app)
-app.config['flask_profiler'] = {
-    'enabled': True,
-    'storage': {
-        'engine': 'sqlite'
-    },
-    'basicAuth': {
-        'enabled': True,
-        'username': 'randall',
-        'password': 'secret'
-    },
-    'ignore': [
-        '^/static/.*'
-    ]
-}
 
 if not os.path.exists('logs'):
     os.mkdir('logs')
@@ -47,4 +32,4 @@ app.logger.addHandler(file_handler)
 app.logger.setLevel(logging.INFO)
 app.logger.info('FencingTournamentTool startup')
 
-from app import routes, models
+from app import routes, models, instrumentation, api
@@ -0,0 +1,199 @@
+"""Read-only JSON API for scoreboards and other displays, under /api/v1.
+
+Each resource is one document built from the database once per data
+version and kept in the cache, like the public pages: a write that calls
+touch() on the event or tournament makes the next request rebuild it.
+Responses carry an ETag, so a display polling an unchanged resource gets
+a 304 after one version lookup, and ?fields=a,b.c trims the document to
+the keys it asks for (dotted paths select inside objects and lists).
+"""
+from functools import wraps
+import hashlib
+import json
+
+from flask import Response, request
+
+from app import app, db, cache
+from app.models import Event, Stage, Tournament, stage_to_string
+from app.bracket import bracket_document
+from app.database import read_only
+from app.export import section_rows
+from app.instrumentation import query_budget
+from app.metrics import cache_lookup
+from app.pools import pool_matrices
+
+PREFIX = '/api/v1'
+
+
+def _dumps(document):
+    return json.dumps(document, separators=(',', ':'), sort_keys=True)
+
+
+def _error(status, message):
+    return Response(_dumps({'error': message}), status=status, mimetype='application/json')
+
+
+def _fields():
+    fields = request.args.get('fields', '')
+    return sorted(set(field.strip() for field in fields.split(',') if field.strip()))
+
+
+def _field_tree(fields):
+    tree = {}
+    for field in fields:
+        node = tree
+        parts = field.split('.')
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+            if node is True:
+                break
+        else:
+            node[parts[-1]] = True
+    return tree
+
+
+def select(value, tree):
+    # the parts of a document named by a _field_tree
+    if tree is True:
+        return value
+    if isinstance(value, list):
+        return [select(item, tree) for item in value]
+    if isinstance(value, dict):
+        return {key: select(value[key], sub) for key, sub in tree.items() if key in value}
+    return value
+
+
+def document(kind, model):
+    # Serves the document `build(obj)` returns for the model instance with
+    # the id in the URL, cached by the instance's version.
+    def decorator(build):
+        @wraps(build)
+        def view(id):
+            row = db.session.query(model.version, model.modified)\
+                .filter(model.id == id).first()
+            if row is None:
+                return _error(404, '{} {} not found'.format(model.__name__.lower(), id))
+            version, modified = row
+            fields = _fields()
+            key = 'api/v1/{}/{}/{}'.format(kind, id, version)
+            etag = hashlib.sha1('{}?fields={}'.format(key, ','.join(fields))
+                                .encode('utf-8')).hexdigest()
+            if modified is not None:
+                modified = modified.replace(microsecond=0)
+            if request.if_none_match.contains(etag):
+                cache_lookup('api_' + kind, 'not_modified')
+                response = Response(status=304)
+            else:
+                body = cache.get(key)
+                cache_lookup('api_' + kind, 'miss' if body is None else 'hit')
+                if body is None:
+                    body = _dumps(build(model.query.get(id)))
+                    cache.set(key, body, timeout=0)
+                if fields:
+                    body = _dumps(select(json.loads(body), _field_tree(fields)))
+                response = Response(body, mimetype='application/json')
+            response.set_etag(etag)
+            if modified is not None:
+                response.last_modified = modified
+            response.headers['Cache-Control'] = 'no-cache'
+            response.headers['Access-Control-Allow-Origin'] = '*'
+            response.headers['Access-Control-Expose-Headers'] = 'ETag'
+            return response
+        return view
+    return decorator
+
+
+def _date(value):
+    return value.isoformat() if value is not None else None
+
+
+def _event_summary(event):
+    return dict(
+        id=event.id, tournament_id=event.tournament_id, name=event.name,
+        weapon=event.weapon, date=_date(event.date), stage=event.stage,
+        stage_name=stage_to_string(event.stage), num_teams=event.num_fencers,
+        num_checked_in=event.num_fencers_checked_in, de_cut=event.de_cut,
+        de_cut_is_percent=event.de_cut_is_percent)
+
+
+def _event_document(event, **document):
+    document.update(event_id=event.id, version=event.version)
+    return document
+
+
+@app.route(PREFIX + '/tournaments/<int:id>')
+@read_only
+@document('tournament', Tournament)
+@query_budget(3)
+def api_tournament(tournament):
+    return dict(id=tournament.id, name=tournament.name, version=tournament.version,
+                events=[_event_summary(event) for event in
+                        tournament.events.order_by(Event.id.asc())])
+
+
+@app.route(PREFIX + '/events/<int:id>')
+@read_only
+@document('event', Event)
+@query_budget(2)
+def api_event(event):
+    document = _event_summary(event)
+    document['version'] = event.version
+    return document
+
+
+@app.route(PREFIX + '/events/<int:id>/registrations')
+@read_only
+@document('registrations', Event)
+@query_budget(3)
+def api_registrations(event):
+    return _event_document(event, teams=list(section_rows(event, 'registration')))
+
+
+@app.route(PREFIX + '/events/<int:id>/pools')
+@read_only
+@document('pools', Event)
+@query_budget(5)
+def api_pools(event):
+    pools = []
+    for number, matrix in sorted(pool_matrices(event).items()):
+        pools.append(dict(
+            number=number, size=matrix.pool.num_fencers,
+            finished=matrix.pool.state == 1,
+            teams=[dict(number=team.num_in_pool, id=team.id, name=team.name,
+                        victories=team.victories, indicator=team.indicator,
+                        touches_scored=team.touches_scored,
+                        touches_received=team.touches_recieved)
+                   for team in matrix.teams],
+            # results[row][column]: the team numbered row + 1 against the
+            # team numbered column + 1, null until fenced
+            results=[[None if result is None else
+                      dict(score=result.fencer_score, win=bool(result.fencer_win))
+                      for result in row] for row in matrix.results]))
+    return _event_document(event, pools=pools)
+
+
+@app.route(PREFIX + '/events/<int:id>/standings')
+@read_only
+@document('standings', Event)
+@query_budget(3)
+def api_standings(event):
+    return _event_document(event, standings=list(section_rows(event, 'standings')))
+
+
+@app.route(PREFIX + '/events/<int:id>/bracket')
+@read_only
+@document('bracket', Event)
+@query_budget(3)
+def api_bracket(event):
+    # the jQuery Bracket document de.html draws, null before DEs start
+    bracket = bracket_document(event)
+    return _event_document(event, bracket=json.loads(bracket) if bracket else None)
+
+
+@app.route(PREFIX + '/events/<int:id>/results')
+@read_only
+@document('results', Event)
+@query_budget(5)
+def api_results(event):
+    return _event_document(event, finished=event.is_stage(Stage.EVENT_FINISHED),
+                           results=list(section_rows(event, 'final')))
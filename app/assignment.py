@@ -0,0 +1,108 @@
+from collections import Counter
+import math
+import random
+import time
+
+
+def _pairs(k):
+    return k * (k - 1) // 2
+
+
+def min_conflicts(clubs, num_pools):
+    # same-club pairs left when every club is spread evenly over the pools
+    conflicts = 0
+    for club, k in Counter(club for club in clubs if club is not None).items():
+        q, r = divmod(k, num_pools)
+        conflicts += r * _pairs(q + 1) + (num_pools - r) * _pairs(q)
+    return conflicts
+
+
+class PoolAssignment():
+
+    def __init__(self, pools, conflicts, imbalance, lower_bound):
+        self.pools = pools  # team ids of each pool, in seed order
+        self.conflicts = conflicts  # pairs of teams from one club sharing a pool
+        self.imbalance = imbalance  # how far pool seed sums are from even
+        self.lower_bound = lower_bound
+
+
+def optimize_pools(teams, sizes, budget=0.5, rng=random):
+    """Assign teams to pools, keeping clubs apart and seed strength even.
+
+    `teams` is a list of (team_id, club_id) in seed order and `sizes` the
+    number of seats of each pool. A greedy snake deal, which avoids clubs
+    already in a pool, is improved by simulated annealing over swaps of two
+    teams until `budget` seconds have passed or 200 swaps per team were tried.
+    Same-club pairings always outweigh seed imbalance.
+    """
+    n, num_pools = len(teams), len(sizes)
+    capacity = list(sizes)
+    for i in range(n - sum(sizes)):  # more teams than seats, grow the largest pools
+        capacity[i % num_pools] += 1
+    clubs = [club for _, club in teams]
+    target = [size * (n + 1) / 2.0 for size in capacity]
+    weight = 2 * n + 2  # one conflict costs more than any single swap can gain
+
+    pool_of = [None] * n
+    seated = [0] * num_pools
+    club_count = [Counter() for _ in range(num_pools)]
+    seed_sum = [0] * num_pools
+    for i, club in enumerate(clubs):
+        row = i // num_pools
+        snake = {p: (p if row % 2 == 0 else num_pools - 1 - p) for p in range(num_pools)}
+        p = min((p for p in range(num_pools) if seated[p] < capacity[p]),
+                key=lambda p: (club_count[p][club] if club is not None else 0,
+                               seated[p] / float(capacity[p]), snake[p]))
+        pool_of[i] = p
+        seated[p] += 1
+        club_count[p][club] += 1
+        seed_sum[p] += i + 1
+
+    conflicts = sum(_pairs(k) for counts in club_count
+                    for club, k in counts.items() if club is not None)
+    imbalance = sum(abs(seed_sum[p] - target[p]) for p in range(num_pools))
+    lower_bound = min_conflicts(clubs, num_pools)
+    best = (conflicts, imbalance, list(pool_of))
+
+    start = time.perf_counter()
+    iterations = 200 * n if num_pools > 1 else 0
+    for it in range(iterations):
+        if it % 256 == 0:
+            elapsed = (time.perf_counter() - start) / budget if budget else 1.0
+            if elapsed >= 1.0:
+                break
+            temperature = n / 2.0 * (1.0 - max(elapsed, it / float(iterations))) + 1e-3
+        a, b = rng.randrange(n), rng.randrange(n)
+        pa, pb = pool_of[a], pool_of[b]
+        if pa == pb:
+            continue
+        ca, cb = clubs[a], clubs[b]
+        d_conflicts = 0
+        if ca != cb:
+            if ca is not None:
+                d_conflicts += club_count[pb][ca] - (club_count[pa][ca] - 1)
+            if cb is not None:
+                d_conflicts += club_count[pa][cb] - (club_count[pb][cb] - 1)
+        d = b - a  # seed difference, moved from pb to pa
+        d_imbalance = (abs(seed_sum[pa] + d - target[pa]) + abs(seed_sum[pb] - d - target[pb])
+                       - abs(seed_sum[pa] - target[pa]) - abs(seed_sum[pb] - target[pb]))
+        delta = d_conflicts * weight + d_imbalance
+        if delta > 0 and rng.random() >= math.exp(-delta / temperature):
+            continue
+        pool_of[a], pool_of[b] = pb, pa
+        club_count[pa][ca] -= 1
+        club_count[pb][ca] += 1
+        club_count[pb][cb] -= 1
+        club_count[pa][cb] += 1
+        seed_sum[pa] += d
+        seed_sum[pb] -= d
+        conflicts += d_conflicts
+        imbalance += d_imbalance
+        if (conflicts, imbalance) < best[:2]:
+            best = (conflicts, imbalance, list(pool_of))
+
+    conflicts, imbalance, pool_of = best
+    pools = [[] for _ in range(num_pools)]
+    for i, (team_id, _) in enumerate(teams):
+        pools[pool_of[i]].append(team_id)
+    return PoolAssignment(pools, conflicts, imbalance, lower_bound)
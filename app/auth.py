@@ -0,0 +1,56 @@
+from flask import g
+
+from app import app, db, cache, login
+from app.models import User, AccessTable
+from app.metrics import cache_lookup
+
+
+def _user_key(id):
+    return 'auth/user/{}'.format(id)
+
+
+def _access_key(user_id):
+    return 'auth/access/{}'.format(user_id)
+
+
+@login.user_loader
+def load_user(id):
+    # The user is cached for AUTH_CACHE_TIMEOUT seconds, so most requests
+    # start without a query. merge(load=False) attaches the cached copy to
+    # this request's session as is.
+    user = cache.get(_user_key(id))
+    cache_lookup('auth_user', 'miss' if user is None else 'hit')
+    if user is None:
+        user = User.query.get(int(id))
+        if user is not None:
+            cache.set(_user_key(id), user, timeout=app.config['AUTH_CACHE_TIMEOUT'])
+        return user
+    return db.session.merge(user, load=False)
+
+
+def tournament_access(user):
+    """Ids of the tournaments `user` is a TO of.
+
+    Loaded at most once per request and shared between requests for
+    AUTH_CACHE_TIMEOUT seconds, so permission checks are set lookups.
+    """
+    if user is None or user.is_anonymous:
+        return frozenset()
+    loaded = g.setdefault('tournament_access', {})
+    if user.id not in loaded:
+        access = cache.get(_access_key(user.id))
+        cache_lookup('auth_access', 'miss' if access is None else 'hit')
+        if access is None:
+            access = frozenset(id for id, in db.session.query(AccessTable.tournament_id)
+                               .filter(AccessTable.user_id == user.id))
+            cache.set(_access_key(user.id), access,
+                      timeout=app.config['AUTH_CACHE_TIMEOUT'])
+        loaded[user.id] = access
+    return loaded[user.id]
+
+
+def forget_user(user_id):
+    # call after committing a change to the user or their TO access
+    cache.delete(_user_key(user_id))
+    cache.delete(_access_key(user_id))
+    g.pop('tournament_access', None)
@@ -0,0 +1,224 @@
+from collections import Counter
+
+from flask.json import htmlsafe_dumps
+
+from sqlalchemy import bindparam
+
+from app import db, cache
+from app.models import DE, DERound, Team
+from app.seeding import seed_bracket
+from app.queries import bakery, execute_compiled
+from app.metrics import cache_lookup
+
+
+def next_match(p):
+    # match the winner of match p moves on to, and the slot taken there
+    return p // 2, 1 if p % 2 == 0 else 2
+
+
+def link_bracket(event, des, third):
+    """Wire up the match graph of a tableau.
+
+    `des` holds the event's DEs (without the bout for third) in heap order:
+    des[0] is the final, des[1:3] the semifinals and so on, so the winner of
+    match p moves on to match p // 2. Semifinal losers go to `third`. One
+    DERound completion counter is created per round, counting the bouts
+    already fenced when an existing tableau is linked.
+    """
+    for i, de in enumerate(des):
+        p = i + 1
+        de.match_num = p
+        if p > 1:
+            n, de.next_slot = next_match(p)
+            de.next_de = des[n - 1]
+        if p in (2, 3) and third is not None:
+            de.loser_de = third
+            de.loser_slot = de.next_slot
+    des = des + [third] if third is not None else des
+    bouts = Counter(de.round for de in des if de.state != 3)
+    finished = Counter(de.round for de in des if de.state == 2)
+    rounds = [DERound(event_id=event.id, round=round, bouts=bouts[round],
+                      finished=finished[round])
+              for round in sorted(set(de.round for de in des))]
+    db.session.add_all(rounds)
+
+
+def create_bracket(event, teams):
+    """Create the DE tableau for `teams`, given in seed order.
+
+    The match tree is built and its byes resolved in memory, then written
+    with one bulk insert of the bouts, one executemany UPDATE linking them
+    and one bulk insert of the round counters.
+    """
+    pairs = seed_bracket(teams)
+    seeds = {team.id: i + 1 for i, team in enumerate(teams)}
+    num_rounds = len(pairs).bit_length()
+    rows = [None]  # rows[p] is match p
+    for p in range(1, 2 * len(pairs)):
+        rows.append(dict(
+            event_id=event.id, match_num=p, is_third=False, state=4,
+            round=num_rounds - (p.bit_length() - 1),
+            team1_id=None, team2_id=None, seed1=None, seed2=None))
+    for p, (team1, team2) in enumerate(pairs, len(pairs)):
+        rows[p].update(
+            team1_id=team1.id,
+            team2_id=None if team2 is None else team2.id,
+            seed1=seeds[team1.id],
+            seed2=None if team2 is None else seeds[team2.id],
+            state=3 if team2 is None else 0)
+        if team2 is None:  # bye, the team moves straight on
+            n, slot = next_match(p)
+            rows[n]['team{}_id'.format(slot)] = team1.id
+            if rows[n]['team1_id'] is not None and rows[n]['team2_id'] is not None:
+                rows[n]['state'] = 0
+    # the semifinal losers fence for third, unless a semifinal is a bye and
+    # its one loser places third outright
+    thirds = []
+    if len(rows) > 3 and rows[2]['state'] != 3 and rows[3]['state'] != 3:
+        thirds.append(dict(
+            event_id=event.id, match_num=None, is_third=True, state=4, round=num_rounds,
+            team1_id=None, team2_id=None, seed1=None, seed2=None))
+    db.session.bulk_insert_mappings(DE, rows[1:] + thirds, render_nulls=True)
+
+    ids = {}
+    for id, match_num in db.session.query(DE.id, DE.match_num)\
+            .filter(DE.event_id == event.id):
+        ids[match_num] = id
+    links = []
+    for p in range(2, len(rows)):
+        n, slot = next_match(p)
+        semifinal = p < 4 and bool(thirds)
+        links.append(dict(
+            id=ids[p], next_de_id=ids[n], next_slot=slot,
+            loser_de_id=ids[None] if semifinal else None,
+            loser_slot=slot if semifinal else None))
+    db.session.bulk_update_mappings(DE, links)
+
+    bouts = Counter(row['round'] for row in rows[1:] + thirds if row['state'] != 3)
+    db.session.bulk_insert_mappings(DERound, [
+        dict(event_id=event.id, round=round, bouts=bouts[round], finished=0)
+        for round in range(1, num_rounds + 1)])
+
+
+def advance_team(de, slot, team):
+    if slot == 1:
+        de.team1 = team
+    else:
+        de.team2 = team
+    if de.team1 is not None and de.team2 is not None:
+        de.state = 0
+
+
+def match_position(de, match_num=None):
+    # (round, match) index of the bout in the tableau's results
+    if de.is_third:
+        return de.round - 1, 1
+    match_num = match_num or de.match_num
+    level = match_num.bit_length() - 1
+    return de.round - 1, match_num - 2 ** level
+
+
+_de_round = DERound.__table__
+_count_bout = _de_round.update()\
+    .where(_de_round.c.event_id == bindparam('event_id'))\
+    .where(_de_round.c.round == bindparam('round'))\
+    .values(finished=_de_round.c.finished + 1)
+_round_progress = bakery(lambda session: session.query(
+    DERound.finished, DERound.bouts).filter(
+        DERound.event_id == bindparam('event_id'), DERound.round == bindparam('round')))
+_margin = db.func.abs(DE.fencer1_score - DE.fencer2_score)
+_round_losers = bakery(lambda session: session.query(DE, _margin).options(
+    db.joinedload(DE.team1), db.joinedload(DE.team2)).filter(
+    DE.event_id == bindparam('event_id'), DE.round == bindparam('round'),
+    DE.team2_id != None).order_by(_margin.desc(), DE.id.asc()))
+_bracket_teams = bakery(lambda session: session.query(
+    db.func.count(DE.team1_id) + db.func.count(DE.team2_id)).filter(
+    DE.event_id == bindparam('event_id'), DE.round == 1))
+
+
+def finish_bout(event, de):
+    """Count a finished elimination bout and place the losers of its round.
+
+    Once every bout of the round is fenced, its losers are placed behind
+    the teams still in, the widest margin of defeat placing lowest. Round 1
+    losers take the last places of the bracket; in a later round r of n,
+    2 ** (n - r) teams are still in and the losers end at 2 ** (n - r + 1).
+    """
+    params = dict(event_id=event.id, round=de.round)
+    execute_compiled(_count_bout, params)
+    finished, bouts = _round_progress(db.session()).params(**params).one()
+    if finished < bouts:
+        return
+    q = _round_losers(db.session()).params(**params)
+    if de.round == 1:
+        place1 = _bracket_teams(db.session()).params(event_id=event.id).scalar()
+    else:
+        num_rounds = de.round + de.match_num.bit_length() - 1
+        place1 = 2 ** (num_rounds - de.round + 1)
+    for i, (de_in_round, margin) in enumerate(q):
+        loser_team = de_in_round.team2 if de_in_round.fencer1_win else de_in_round.team1
+        loser_team.final_place = place1 - i
+        loser_team.de_indicator = margin
+
+
+_open_bouts = bakery(lambda session: session.query(db.func.count(DE.id)).filter(
+    DE.event_id == bindparam('event_id'), DE.state == 0))
+_placed_teams = bakery(lambda session: session.query(Team).filter(
+    Team.event_id == bindparam('event_id'), Team.is_checked_in == True,
+    Team.final_place.isnot(None)).order_by(Team.final_place.asc()))
+
+
+def open_bouts(event):  # bouts ready to be fenced
+    return _open_bouts(db.session()).params(event_id=event.id).scalar()
+
+
+def placed_teams(event):  # teams with a final place, best first
+    return _placed_teams(db.session()).params(event_id=event.id).all()
+
+
+def _seeded_name(team, seed):
+    if team is None:
+        return None
+    return team.name if seed is None else team.name + " (" + str(seed) + ")"
+
+
+def _build_document(event):
+    des = event.des.options(db.joinedload(DE.team1), db.joinedload(DE.team2))\
+        .order_by(DE.id.asc()).all()
+    if not des:
+        return ''
+    num_rounds = max(de.round for de in des)
+    results = [[None] * 2 ** (num_rounds - round) for round in range(1, num_rounds)]
+    results.append([None, None])
+    teams = [None] * 2 ** (num_rounds - 1)
+    match_num = 0
+    for de in des:
+        if not de.is_third:
+            match_num += 1  # ids are in heap order, for brackets not linked yet
+        round, match = match_position(de, de.match_num or match_num)
+        if de.state == 2:
+            results[round][match] = [de.fencer1_score, de.fencer2_score]
+        else:
+            results[round][match] = [
+                None, None, 'third' if de.is_third else 'match' + str(match_num)]
+        if de.round == 1:
+            teams[match] = [_seeded_name(de.team1, de.seed1),
+                            _seeded_name(de.team2, de.seed2)]
+    if not any(de.is_third for de in des):
+        results[-1].pop()  # no bout for third
+    return htmlsafe_dumps({'teams': teams, 'results': results})
+
+
+def bracket_document(event):
+    """The event's tableau as a serialized jQuery Bracket document.
+
+    The document is built from the DE rows once per event version and served
+    from the cache as is. Returns None before the bracket is generated.
+    """
+    key = 'bracket/{}/{}'.format(event.id, event.version)
+    document = cache.get(key)
+    cache_lookup('bracket', 'miss' if document is None else 'hit')
+    if document is None:
+        document = _build_document(event)
+        cache.set(key, document, timeout=0)
+    return document or None
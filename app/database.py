@@ -0,0 +1,123 @@
+"""Database setup for one writer and many readers on SQLite.
+
+Every SQLite connection is opened with the journal mode, busy timeout,
+synchronous level and page cache from the config. In WAL mode readers
+see the last committed data while a tournament organizer's write is in
+progress instead of waiting for it, and a writer queued behind another
+waits up to SQLITE_BUSY_TIMEOUT instead of failing with "database is
+locked".
+
+Views marked @read_only run their queries on a second engine whose
+connections refuse to write, so public pages never take a write lock or
+wait for a pool slot behind a write.
+"""
+from functools import wraps
+import weakref
+
+from flask import g, has_request_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import event, orm
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import NullPool, QueuePool
+
+READ_ONLY = 'read_only'  # bind key of the read-only engine
+
+JOURNAL_MODES = ('DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF')
+SYNCHRONOUS = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+
+_read_only_engines = weakref.WeakSet()
+
+
+def _in_memory(uri):
+    url = make_url(uri)
+    return url.drivername.startswith('sqlite') and url.database in (None, '', ':memory:')
+
+
+def _pragmas(config):
+    journal_mode = config['SQLITE_JOURNAL_MODE'].upper()
+    synchronous = config['SQLITE_SYNCHRONOUS'].upper()
+    if journal_mode not in JOURNAL_MODES:
+        raise ValueError('Unknown SQLITE_JOURNAL_MODE {}'.format(journal_mode))
+    if synchronous not in SYNCHRONOUS:
+        raise ValueError('Unknown SQLITE_SYNCHRONOUS {}'.format(synchronous))
+    return ['PRAGMA busy_timeout = {:d}'.format(config['SQLITE_BUSY_TIMEOUT']),
+            'PRAGMA journal_mode = {}'.format(journal_mode),
+            'PRAGMA synchronous = {}'.format(synchronous),
+            'PRAGMA cache_size = {:d}'.format(config['SQLITE_CACHE_SIZE'])]
+
+
+def _execute_on_connect(engine, statements):
+    def connect(dbapi_connection, record):
+        cursor = dbapi_connection.cursor()
+        for statement in statements:
+            cursor.execute(statement)
+        cursor.close()
+    event.listen(engine, 'connect', connect)
+
+
+class RoutingSession(SignallingSession):
+    # sends every statement of a @read_only request to the read-only engine
+
+    def __init__(self, db, **options):
+        self.read_engine = db.get_read_engine()
+        SignallingSession.__init__(self, db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        if self.read_engine is not None and has_request_context() and g.get('read_only'):
+            return self.read_engine
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+class Database(SQLAlchemy):
+
+    def init_app(self, app):
+        # the read-only engine is an extra bind on SQLALCHEMY_READ_ONLY_URI,
+        # left out for an in-memory database, which a second engine can't see
+        uri = app.config.get('SQLALCHEMY_READ_ONLY_URI')
+        if uri and not _in_memory(uri):
+            binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+            binds[READ_ONLY] = uri
+            app.config['SQLALCHEMY_BINDS'] = binds
+        SQLAlchemy.init_app(self, app)
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        SQLAlchemy.apply_driver_hacks(self, app, sa_url, options)
+        if options.get('poolclass') is NullPool:
+            # Keep SQLite connections open between requests: a new one runs
+            # the pragmas again, and closing the last one checkpoints and
+            # removes the WAL. Each is used by one request at a time.
+            options['poolclass'] = QueuePool
+            options.setdefault('connect_args', {})['check_same_thread'] = False
+
+    def create_engine(self, sa_url, engine_opts):
+        engine = SQLAlchemy.create_engine(self, sa_url, engine_opts)
+        if engine.dialect.name == 'sqlite':
+            _execute_on_connect(engine, _pragmas(self.get_app().config))
+        return engine
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def get_engine(self, app=None, bind=None):
+        engine = SQLAlchemy.get_engine(self, app, bind)
+        if bind == READ_ONLY and engine.dialect.name == 'sqlite':
+            with self._engine_lock:
+                if engine not in _read_only_engines:
+                    _read_only_engines.add(engine)
+                    _execute_on_connect(engine, ['PRAGMA query_only = ON'])
+        return engine
+
+    def get_read_engine(self, app=None):
+        app = self.get_app(app)
+        if READ_ONLY not in (app.config['SQLALCHEMY_BINDS'] or {}):
+            return None
+        return self.get_engine(app, bind=READ_ONLY)
+
+
+def read_only(f):
+    # runs a view's queries on the read-only engine; it must not write
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        g.read_only = True
+        return f(*args, **kwargs)
+    return decorated_function
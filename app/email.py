@@ -1,17 +1,190 @@
+from collections import OrderedDict
+from itertools import count
+import queue
+import smtplib
+import threading
+import time
+
 from flask import render_template
 from flask_mail import Message
 from app import app, mail
-from threading import Thread
+from app.metrics import Counter, Gauge
+
+
+class Delivery():
+    # status of one queued message: queued, sending, retrying, sent or failed
+
+    _ids = count(1)
+
+    def __init__(self, message, tag=None):
+        self.id = next(self._ids)
+        self.message = message
+        self.tag = tag
+        self.status = 'queued'
+        self.attempts = 0
+        self.error = None
+        self.queued_at = time.time()
+        self.finished_at = None
+
+    def finish(self, status, error=None):
+        self.status = status
+        self.error = error
+        self.finished_at = time.time()
+        emails_finished.inc(status=status)
+
+    def as_dict(self):
+        return dict(id=self.id, tag=self.tag, subject=self.message.subject,
+                    recipients=list(self.message.recipients), status=self.status,
+                    attempts=self.attempts, error=self.error,
+                    queued_at=self.queued_at, finished_at=self.finished_at)
+
+
+class MailQueue():
+    """Bounded outbound mail queue served by a fixed pool of workers.
+
+    A worker takes up to MAIL_BATCH_SIZE waiting messages and sends them
+    over one SMTP connection. Messages that fail for a transient reason,
+    or are cut off by a dropped connection, are retried on a new connection
+    after MAIL_RETRY_DELAY seconds, doubling each time, up to MAIL_RETRIES
+    times. The status of the last MAIL_STATUS_HISTORY messages is kept.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.lock = threading.Lock()
+        self.queue = None
+        self.workers = []
+        self.in_flight = 0
+        self.deliveries = OrderedDict()
+
+    def _start(self):
+        with self.lock:
+            if self.queue is not None:
+                return
+            self.queue = queue.Queue(maxsize=self.app.config['MAIL_QUEUE_SIZE'])
+            for _ in range(self.app.config['MAIL_WORKERS']):
+                worker = threading.Thread(target=self._run, daemon=True)
+                worker.start()
+                self.workers.append(worker)
 
-def send_async_email(app, msg):
-    with app.app_context():
-        mail.send(msg)
+    def put(self, message, tag=None):
+        self._start()
+        delivery = Delivery(message, tag)
+        with self.lock:
+            self.deliveries[delivery.id] = delivery
+            while len(self.deliveries) > self.app.config['MAIL_STATUS_HISTORY']:
+                self.deliveries.popitem(last=False)
+        try:
+            self.queue.put(delivery, timeout=self.app.config['MAIL_ENQUEUE_TIMEOUT'])
+        except queue.Full:
+            delivery.finish('failed', 'mail queue is full')
+            self.app.logger.error('Mail queue full, dropped "%s" to %s',
+                                  message.subject, ', '.join(message.recipients))
+        return delivery
 
-def send_email(subject, sender, recipients, text_body, html_body):
+    def join(self):  # wait until every queued message is sent or has failed
+        if self.queue is not None:
+            self.queue.join()
+
+    def depth(self):
+        with self.lock:
+            return (self.queue.qsize() if self.queue is not None else 0) + self.in_flight
+
+    def status(self, tag=None):
+        with self.lock:
+            deliveries = list(self.deliveries.values())
+        return [d for d in deliveries if tag is None or d.tag == tag]
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.app.config['MAIL_BATCH_SIZE']:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            with self.lock:
+                self.in_flight += len(batch)
+            try:
+                with self.app.app_context():
+                    self._deliver(batch)
+            except Exception:
+                self.app.logger.exception('Mail delivery failed')
+                for delivery in batch:
+                    if delivery.finished_at is None:
+                        delivery.finish('failed', 'internal error')
+            finally:
+                with self.lock:
+                    self.in_flight -= len(batch)
+                for _ in batch:
+                    self.queue.task_done()
+
+    def _deliver(self, batch):
+        retries = self.app.config['MAIL_RETRIES']
+        delay = self.app.config['MAIL_RETRY_DELAY']
+        while batch:
+            retry = []
+            for delivery in self._send_batch(batch):
+                if delivery.attempts > retries:
+                    delivery.finish('failed', delivery.error)
+                    self.app.logger.warning('Giving up on "%s" to %s: %s',
+                                            delivery.message.subject,
+                                            ', '.join(delivery.message.recipients),
+                                            delivery.error)
+                else:
+                    delivery.status = 'retrying'
+                    retry.append(delivery)
+            if retry:
+                time.sleep(delay * 2 ** (max(d.attempts for d in retry) - 1))
+            batch = retry
+
+    def _send_batch(self, batch):
+        # Sends over one connection, returning the messages to try again. A
+        # failed connect is an attempt for every message; after a dropped
+        # connection only the message being sent has used one.
+        tried = 0
+        try:
+            smtp_connections.inc()
+            with mail.connect() as connection:
+                for delivery in batch:
+                    tried += 1
+                    delivery.status = 'sending'
+                    delivery.attempts += 1
+                    try:
+                        connection.send(delivery.message)
+                    except smtplib.SMTPResponseException as e:
+                        error = '{} {}'.format(e.smtp_code, e.smtp_error)
+                        if e.smtp_code >= 500:  # permanent
+                            delivery.finish('failed', error)
+                        else:
+                            delivery.error = error
+                        continue
+                    except smtplib.SMTPRecipientsRefused:
+                        delivery.finish('failed', 'recipients refused')
+                        continue
+                    delivery.finish('sent')
+        except (smtplib.SMTPException, OSError) as e:
+            for delivery in batch:
+                if delivery.finished_at is None:
+                    delivery.error = '{}: {}'.format(type(e).__name__, e)
+                    if not tried:
+                        delivery.attempts += 1
+        return [delivery for delivery in batch if delivery.finished_at is None]
+
+
+mail_queue = MailQueue(app)
+emails_finished = Counter('ftt_emails_total', 'Outbound emails sent or given up on.',
+                          ('status',))
+smtp_connections = Counter('ftt_smtp_connections_total', 'SMTP connections opened.')
+Gauge('ftt_email_queue_depth', 'Outbound emails waiting to be sent.',
+      lambda: {(): mail_queue.depth()})
+
+
+def send_email(subject, sender, recipients, text_body, html_body, tag=None):
     msg = Message(subject, sender=sender, recipients=recipients)
     msg.body = text_body
     msg.html = html_body
-    Thread(target=send_async_email, args=(app, msg)).start()
+    return mail_queue.put(msg, tag)
 
 
 def send_password_reset_email(user):
@@ -25,13 +198,18 @@ def send_password_reset_email(user):
                                          user=user, token=token))
 
 
+def prereg_tag(tournament):
+    return 'prereg/{}'.format(tournament.id)
+
+
 def send_prereg_email(email, token, club, tournament):
-    send_email('[FencingTournamentTool] SWIFA Preregistration',
-               sender=app.config['ADMINS'][0],
-               recipients=[email],
-               text_body=render_template('email/preregistration.txt',
-                                         club=club, tournament=tournament,
-                                         token=token),
-               html_body=render_template('email/preregistration.html',
-                                         club=club, tournament=tournament,
-                                         token=token))
+    return send_email('[FencingTournamentTool] SWIFA Preregistration',
+                      sender=app.config['ADMINS'][0],
+                      recipients=[email],
+                      text_body=render_template('email/preregistration.txt',
+                                                club=club, tournament=tournament,
+                                                token=token),
+                      html_body=render_template('email/preregistration.html',
+                                                club=club, tournament=tournament,
+                                                token=token),
+                      tag=prereg_tag(tournament))
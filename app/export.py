@@ -0,0 +1,187 @@
+import csv
+import io
+from itertools import groupby
+import json
+
+from app import db
+from app.models import Club, DE, Fencer, Pool, Result, Standing, Team
+
+# Rows are read with yield_per, which also asks the driver for a server-side
+# cursor where it has one, so an export never holds more than a batch of
+# rows and the first bytes go out before the last query has finished.
+BATCH_SIZE = 500
+CHUNK_SIZE = 8192
+
+COLUMNS = {
+    'registration': ['team', 'club', 'fencer_a', 'fencer_b', 'fencer_c', 'fencer_d',
+                     'checked_in'],
+    'pool_bouts': ['pool', 'pool_letter', 'team', 'fencer', 'opponent_team', 'opponent',
+                   'score', 'win'],
+    'standings': ['place', 'team', 'win_percent', 'indicator', 'touches_scored'],
+    'de_bouts': ['round', 'match', 'third_place', 'team1', 'seed1', 'team2', 'seed2',
+                 'score1', 'score2', 'winner', 'state'],
+    'final': ['place', 'team', 'club', 'decided_in'],
+}
+SECTIONS = list(COLUMNS)
+DE_STATES = {0: 'not started', 1: 'in progress', 2: 'finished', 3: 'bye', 4: 'tbd'}
+
+
+def _full_name(first, last):
+    return ' '.join(name for name in (first, last) if name) or None
+
+
+def _registration(event):
+    rows = db.session.query(Team.id, Team.name, Club.name, Team.is_checked_in,
+                            Fencer.team_position, Fencer.first_name, Fencer.last_name)\
+        .outerjoin(Club, Team.club_id == Club.id)\
+        .outerjoin(Fencer, Fencer.team_id == Team.id)\
+        .filter(Team.event_id == event.id)\
+        .order_by(Team.id.asc(), Fencer.team_position.asc())\
+        .yield_per(BATCH_SIZE)
+    for _, fencers in groupby(rows, key=lambda row: row[0]):
+        fencers = list(fencers)
+        row = dict(team=fencers[0][1], club=fencers[0][2], checked_in=fencers[0][3])
+        for position in 'ABCD':
+            row['fencer_' + position.lower()] = None
+        for _, _, _, _, position, first, last in fencers:
+            if position:
+                row['fencer_' + position.lower()] = _full_name(first, last)
+        yield row
+
+
+def _pool_bouts(event):
+    team, opponent_team = db.aliased(Team), db.aliased(Team)
+    fencer, opponent = db.aliased(Fencer), db.aliased(Fencer)
+    rows = db.session.query(
+        Pool.poolNum, Pool.pool_letter, team.name, fencer.first_name, fencer.last_name,
+        opponent_team.name, opponent.first_name, opponent.last_name,
+        Result.fencer_score, Result.fencer_win)\
+        .join(Pool, Result.pool_id == Pool.id)\
+        .outerjoin(team, Result.team_id == team.id)\
+        .outerjoin(opponent_team, Result.opponent_team_id == opponent_team.id)\
+        .outerjoin(fencer, Result.fencer == fencer.id)\
+        .outerjoin(opponent, Result.opponent == opponent.id)\
+        .filter(Pool.event_id == event.id)\
+        .order_by(Pool.poolNum.asc(), Pool.pool_letter.asc(), Result.id.asc())\
+        .yield_per(BATCH_SIZE)
+    for (pool, letter, team_name, first, last, opponent_name, opponent_first,
+         opponent_last, score, win) in rows:
+        yield dict(pool=pool, pool_letter=letter, team=team_name,
+                   fencer=_full_name(first, last), opponent_team=opponent_name,
+                   opponent=_full_name(opponent_first, opponent_last),
+                   score=score, win=win)
+
+
+def _standings(event):
+    rows = db.session.query(Standing.place, Standing.is_tied, Team.name,
+                            Standing.win_percent, Standing.indicator,
+                            Standing.touches_scored)\
+        .join(Team, Standing.team_id == Team.id)\
+        .filter(Standing.event_id == event.id)\
+        .order_by(Standing.place.asc(), Standing.team_id.asc())\
+        .yield_per(BATCH_SIZE)
+    for place, is_tied, name, win_percent, indicator, touches_scored in rows:
+        yield dict(place=str(place) + ('T' if is_tied else ''), team=name,
+                   win_percent=round(win_percent, 3), indicator=indicator,
+                   touches_scored=touches_scored)
+
+
+def _de_bouts(event):
+    team1, team2 = db.aliased(Team), db.aliased(Team)
+    rows = db.session.query(DE.round, DE.match_num, DE.is_third, team1.name, DE.seed1,
+                            team2.name, DE.seed2, DE.fencer1_score, DE.fencer2_score,
+                            DE.fencer1_win, DE.state)\
+        .outerjoin(team1, DE.team1_id == team1.id)\
+        .outerjoin(team2, DE.team2_id == team2.id)\
+        .filter(DE.event_id == event.id)\
+        .order_by(DE.round.asc(), DE.id.asc())\
+        .yield_per(BATCH_SIZE)
+    for (round, match, is_third, name1, seed1, name2, seed2, score1, score2, team1_won,
+         state) in rows:
+        winner = None
+        if state == 2:
+            winner = name1 if team1_won else name2
+        elif state == 3:
+            winner = name1 or name2
+        yield dict(round=round, match=match, third_place=bool(is_third), team1=name1,
+                   seed1=seed1, team2=name2, seed2=seed2, score1=score1, score2=score2,
+                   winner=winner, state=DE_STATES.get(state))
+
+
+def _final(event):
+    # the order of public_final: teams placed in the DEs, then the rest of
+    # the pool standings below the cut
+    placed = db.session.query(Team.name, Club.name)\
+        .outerjoin(Club, Team.club_id == Club.id)\
+        .filter(Team.event_id == event.id, Team.is_checked_in == True,
+                Team.final_place.isnot(None))\
+        .order_by(Team.final_place.asc())\
+        .yield_per(BATCH_SIZE)
+    place = 0
+    for name, club in placed:
+        place += 1
+        yield dict(place=place, team=name, club=club, decided_in='de')
+    cut = event.de_cut_size(event.standings.count())
+    rest = db.session.query(Team.name, Club.name)\
+        .join(Standing, Standing.team_id == Team.id)\
+        .outerjoin(Club, Team.club_id == Club.id)\
+        .filter(Standing.event_id == event.id)\
+        .order_by(Standing.place.asc(), Standing.team_id.asc())\
+        .offset(cut)\
+        .yield_per(BATCH_SIZE)
+    for name, club in rest:
+        place += 1
+        yield dict(place=place, team=name, club=club, decided_in='pools')
+
+
+_readers = {'registration': _registration, 'pool_bouts': _pool_bouts,
+            'standings': _standings, 'de_bouts': _de_bouts, 'final': _final}
+
+
+def section_rows(event, section):
+    return _readers[section](event)
+
+
+def _chunked(lines):
+    # joins small lines so the server isn't asked to write one row at a time;
+    # the first goes out on its own so the download starts straight away
+    lines = iter(lines)
+    for line in lines:
+        yield line
+        break
+    buffer, size = [], 0
+    for line in lines:
+        buffer.append(line)
+        size += len(line)
+        if size >= CHUNK_SIZE:
+            yield ''.join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def export_csv(event, section):
+    columns = COLUMNS[section]
+    out = io.StringIO()
+    writer = csv.DictWriter(out, columns, lineterminator='\n')
+
+    def lines():
+        writer.writeheader()
+        yield out.getvalue()
+        for row in section_rows(event, section):
+            out.seek(0)
+            out.truncate()
+            writer.writerow(row)
+            yield out.getvalue()
+
+    return _chunked(lines())
+
+
+def export_ndjson(event, sections=SECTIONS):
+    def lines():
+        for section in sections:
+            for row in section_rows(event, section):
+                row['section'] = section
+                yield json.dumps(row) + '\n'
+
+    return _chunked(lines())
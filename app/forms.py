@@ -5,9 +5,10 @@ from wtforms import StringField, PasswordField, BooleanField, \
                     SubmitField, HiddenField, IntegerField, \
                     SelectField, FormField, widgets, FileField, \
                     TextAreaField
-from wtforms.validators import DataRequired, Email, EqualTo, ValidationError, Length, Optional, NoneOf
+from wtforms.validators import DataRequired, Email, EqualTo, ValidationError, Length, Optional, NoneOf, NumberRange
 from wtforms.fields.html5 import DateField
 from app.models import User
+from app.seeding import MAX_BRACKET_SIZE
 
 
 class LoginForm(FlaskForm):
@@ -52,8 +53,16 @@ class CreateEventForm(FlaskForm):
     ]
     weapon = SelectField('Weapon', choices=choices, validators=[NoneOf(['none'], message='Please select a Weapon.')])
     date = DateField('Date', format='%Y-%m-%d', validators=[DataRequired()])
+    de_cut = IntegerField('DE cut', default=12, validators=[NumberRange(min=2, max=MAX_BRACKET_SIZE)])
+    de_cut_type = SelectField('DE cut by', default='count', choices=[
+        ('count', 'Number of teams'),
+        ('percent', 'Percent of teams')])
     submit = SubmitField('Create Event')
 
+    def validate_de_cut(self, de_cut):
+        if self.de_cut_type.data == 'percent' and de_cut.data > 100:
+            raise ValidationError('A percentage cut cannot be more than 100.')
+
     def validate_date(self, date):
         present = pydate.today()
         if datetime.strptime(date.data.strftime('%Y-%m-%d'), '%Y-%m-%d').date() < present:
@@ -148,6 +157,11 @@ class EmailListForm(FlaskForm):
     submit = SubmitField('Send Preregistration Emails')
 
 
+class RosterImportForm(FlaskForm):
+    roster = FileField('Import Teams (CSV or JSON)', validators=[DataRequired()], filters=[lambda x : x or None])
+    submit = SubmitField('Import Teams')
+
+
 class ResetPasswordRequestForm(FlaskForm):
     email = StringField('Email', validators=[DataRequired(), Email()])
     submit = SubmitField('Request Password Reset')
@@ -0,0 +1,105 @@
+from contextlib import contextmanager
+import time
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app import app
+from app.metrics import observe_request
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class QueryStats():
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0  # seconds spent in the database
+        self.slowest = 0.0
+        self.slowest_statement = None
+
+    def record(self, statement, duration):
+        self.count += 1
+        self.duration += duration
+        if duration >= self.slowest:
+            self.slowest = duration
+            self.slowest_statement = statement
+
+
+_counters = []  # open count_queries() blocks
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_query(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _end_query(conn, cursor, statement, parameters, context, executemany):
+    duration = time.perf_counter() - conn.info['query_start'].pop()
+    if has_request_context() and 'query_stats' in g:
+        g.query_stats.record(statement, duration)
+    for stats in _counters:
+        stats.record(statement, duration)
+
+
+@contextmanager
+def count_queries():
+    """Count the statements run inside the block, requests included.
+
+        with count_queries() as stats:
+            client.get('/explore')
+        assert stats.count <= 4
+    """
+    stats = QueryStats()
+    _counters.append(stats)
+    try:
+        yield stats
+    finally:
+        _counters.remove(stats)
+
+
+def query_budget(limit):
+    # Most statements a view may run per request, going over is logged or,
+    # with QUERY_BUDGET_STRICT, raised. Goes right above the def.
+    def decorator(f):
+        f.query_budget = limit
+        return f
+    return decorator
+
+
+@app.before_request
+def start_request_timing():
+    g.request_start = time.perf_counter()
+    g.query_stats = QueryStats()
+
+
+@app.after_request
+def report_request_timing(response):
+    if 'query_stats' not in g:
+        return response
+    stats = g.query_stats
+    total = time.perf_counter() - g.request_start
+    response.headers.add('Server-Timing', 'db;dur={:.2f};desc="{} queries"'.format(
+        stats.duration * 1000, stats.count))
+    response.headers.add('Server-Timing', 'db-slowest;dur={:.2f}'.format(stats.slowest * 1000))
+    response.headers.add('Server-Timing', 'app;dur={:.2f}'.format(total * 1000))
+    app.logger.info(
+        'request method=%s path=%s endpoint=%s status=%d queries=%d db_ms=%.2f '
+        'slowest_ms=%.2f total_ms=%.2f', request.method, request.path, request.endpoint,
+        response.status_code, stats.count, stats.duration * 1000, stats.slowest * 1000,
+        total * 1000)
+    observe_request(request.endpoint, request.method, response.status_code, total, stats.count)
+
+    view = app.view_functions.get(request.endpoint)
+    budget = getattr(view, 'query_budget', None)
+    if budget is not None and stats.count > budget:
+        message = '{} ran {} queries, over its budget of {}. Slowest: {}'.format(
+            request.endpoint, stats.count, budget, stats.slowest_statement)
+        if app.config['QUERY_BUDGET_STRICT']:
+            raise QueryBudgetExceeded(message)
+        app.logger.warning(message)
+    return response
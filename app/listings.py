@@ -0,0 +1,46 @@
+from collections import namedtuple, OrderedDict
+
+from app import app, db
+from app.models import AccessTable, Event, Tournament
+
+TournamentSummary = namedtuple('TournamentSummary', 'id name events')
+EventSummary = namedtuple(
+    'EventSummary', 'id name date stage num_fencers num_fencers_checked_in')
+
+
+def tournament_listing(before=None, user_id=None, per_page=None):
+    """One page of tournaments, newest first, with a summary of their events.
+
+    Pages are keyed on the tournament id: `before` is the id the previous
+    page ended at. Returns (tournaments, before) where `before` is the key
+    of the next page, or None on the last one. The page and all of its
+    events come back from a single query; with `user_id` only tournaments
+    that user organizes are listed.
+    """
+    per_page = per_page or app.config['TOURNAMENTS_PER_PAGE']
+    page = db.session.query(Tournament.id)
+    if before is not None:
+        page = page.filter(Tournament.id < before)
+    if user_id is not None:
+        page = page.filter(Tournament.id.in_(
+            db.session.query(AccessTable.tournament_id)
+            .filter(AccessTable.user_id == user_id)))
+    page = page.order_by(Tournament.id.desc()).limit(per_page + 1).subquery()
+    rows = db.session.query(
+        Tournament.id, Tournament.name, Event.id, Event.name, Event.date, Event.stage,
+        Event.num_fencers, Event.num_fencers_checked_in)\
+        .join(page, page.c.id == Tournament.id)\
+        .outerjoin(Event, Event.tournament_id == Tournament.id)\
+        .order_by(Tournament.id.desc(), Event.id.asc())
+
+    tournaments = OrderedDict()
+    for row in rows:
+        tournament = tournaments.get(row[0])
+        if tournament is None:
+            tournament = tournaments[row[0]] = TournamentSummary(row[0], row[1], [])
+        if row[2] is not None:
+            tournament.events.append(EventSummary(*row[2:]))
+    tournaments = list(tournaments.values())
+    if len(tournaments) > per_page:
+        return tournaments[:per_page], tournaments[per_page - 1].id
+    return tournaments, None
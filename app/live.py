@@ -0,0 +1,163 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+import json
+import queue
+import threading
+import time
+
+from app import app, db
+from app.models import LiveUpdate
+from app.metrics import Gauge
+
+KEEPALIVE = 15  # seconds between comments on an idle stream
+PRUNE_INTERVAL = 60  # seconds between deletes of expired updates
+
+
+def publish(event_id, kind, data):
+    # written in the same transaction as the change it describes
+    db.session.add(LiveUpdate(event_id=event_id, kind=kind, data=json.dumps(data)))
+    broadcaster.start()
+
+
+def pool_payload(matrix):
+    teams = []
+    for team in matrix.teams:
+        results = matrix.results[team.num_in_pool - 1] \
+            if 0 < team.num_in_pool <= len(matrix.results) else []
+        teams.append({
+            'num': team.num_in_pool,
+            'victories': team.victories,
+            'win_percent': team.victories / (matrix.pool.num_fencers - 1)
+            if matrix.pool.num_fencers > 1 else 0,
+            'touches_scored': team.touches_scored,
+            'touches_recieved': team.touches_recieved,
+            'indicator': team.indicator,
+            'results': [None if result is None else
+                        [bool(result.fencer_win), result.fencer_score]
+                        for result in results]})
+    return {'pool': matrix.pool.poolNum, 'teams': teams}
+
+
+def format_update(id, kind, data):
+    return 'id: {}\nevent: {}\ndata: {}\n\n'.format(id, kind, data)
+
+
+class Broadcaster():
+    """Fans new LiveUpdate rows out to the streams open in this process.
+
+    A single background thread (a greenlet under gevent workers) polls the
+    table, so idle streams cost a queue each and no database work. It also
+    deletes updates older than LIVE_RETENTION once a minute; a stream
+    resuming from an older Last-Event-ID only gets what is left.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.subscribers = defaultdict(set)
+        self.lock = threading.Lock()
+        self.thread = None
+        self.last_id = None  # newest update seen, read when the first stream opens
+        self.next_prune = 0
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+
+    def subscribe(self, event_id):
+        q = queue.Queue(maxsize=100)
+        with self.lock:
+            if self.last_id is None:
+                self.last_id = self._max_id()
+            self.subscribers[event_id].add(q)
+        self.start()
+        return q
+
+    def unsubscribe(self, event_id, q):
+        with self.lock:
+            self.subscribers[event_id].discard(q)
+            if not self.subscribers[event_id]:
+                del self.subscribers[event_id]
+
+    def connections(self):
+        with self.lock:
+            return sum(len(qs) for qs in self.subscribers.values())
+
+    def _max_id(self):
+        with self.app.app_context():
+            last_id = db.session.query(db.func.max(LiveUpdate.id)).scalar()
+            db.session.remove()
+        return last_id or 0
+
+    def _poll(self):
+        with self.app.app_context():
+            updates = db.session.query(
+                LiveUpdate.id, LiveUpdate.event_id, LiveUpdate.kind, LiveUpdate.data)\
+                .filter(LiveUpdate.id > self.last_id)\
+                .order_by(LiveUpdate.id.asc()).all()
+            db.session.remove()
+        for id, event_id, kind, data in updates:
+            self.last_id = id
+            with self.lock:
+                subscribers = list(self.subscribers.get(event_id, ()))
+            for q in subscribers:
+                try:
+                    q.put_nowait((id, kind, data))
+                except queue.Full:
+                    pass
+
+    def _prune(self):
+        cutoff = datetime.utcnow() - timedelta(seconds=self.app.config['LIVE_RETENTION'])
+        with self.app.app_context():
+            LiveUpdate.query.filter(db.or_(LiveUpdate.created < cutoff,
+                                           LiveUpdate.created == None))\
+                .delete(synchronize_session=False)
+            db.session.commit()
+            db.session.remove()
+
+    def _run(self):
+        while True:
+            time.sleep(self.app.config['LIVE_POLL_INTERVAL'])
+            try:
+                if time.time() >= self.next_prune:
+                    self.next_prune = time.time() + PRUNE_INTERVAL
+                    self._prune()
+                if self.subscribers:
+                    self._poll()
+            except Exception:
+                self.app.logger.exception('Live update poll failed')
+
+
+broadcaster = Broadcaster(app)
+Gauge('ftt_live_connections', 'Open live update (SSE) streams.',
+      lambda: {(): broadcaster.connections()})
+
+
+def event_stream(event_id, last_event_id=None):
+    q = broadcaster.subscribe(event_id)
+    backlog = []
+    if last_event_id is not None:  # reconnecting client, replay what it missed
+        backlog = db.session.query(LiveUpdate.id, LiveUpdate.kind, LiveUpdate.data)\
+            .filter(LiveUpdate.event_id == event_id, LiveUpdate.id > last_event_id)\
+            .order_by(LiveUpdate.id.asc()).all()
+
+    def generate():
+        try:
+            yield 'retry: 5000\n\n'
+            last = last_event_id or 0
+            for update in backlog:
+                yield format_update(*update)
+                last = update[0]
+            while True:
+                try:
+                    update = q.get(timeout=KEEPALIVE)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                if update[0] > last:
+                    yield format_update(*update)
+                    last = update[0]
+        finally:
+            broadcaster.unsubscribe(event_id, q)
+    return generate()
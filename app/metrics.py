@@ -0,0 +1,162 @@
+"""Process metrics in the Prometheus text format, served at /metrics.
+
+Values live in memory and are per process; boot.sh runs a single gevent
+worker, so one scrape sees the whole server.
+"""
+from bisect import bisect_left
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.pool import Pool
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ('{}="{}"'.format(name, str(value).replace('\\', r'\\').replace('"', r'\"'))
+             for name, value in zip(names, values))
+    return '{' + ','.join(pairs) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if value != float('inf') else '+Inf'
+
+
+class Metric():
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}
+        registry.append(self)
+
+    def _key(self, labels):
+        return tuple(labels[name] for name in self.labels)
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, self.labels, key, value)
+                    for key, value in sorted(self.values.items())]
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.help),
+                 '# TYPE {} {}'.format(self.name, self.kind)]
+        for name, names, values, value in self.samples():
+            lines.append('{}{} {}'.format(name, _format_labels(names, values),
+                                          _format_value(value)))
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    # read from `collect` when scraped, a function returning
+    # {label values: value}
+    kind = 'gauge'
+
+    def __init__(self, name, help, collect, labels=()):
+        Metric.__init__(self, name, help, labels)
+        self.collect = collect
+
+    def samples(self):
+        return [(self.name, self.labels, key, value)
+                for key, value in sorted(self.collect().items())]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        Metric.__init__(self, name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect_left(self.buckets, value)] += 1
+            self.values[key] = (counts, total + value)
+
+    def samples(self):
+        samples = []
+        names = self.labels + ('le',)
+        with self.lock:
+            items = sorted((key, (list(counts), total))
+                           for key, (counts, total) in self.values.items())
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                samples.append((self.name + '_bucket', names, key + (_format_value(bound),),
+                                cumulative))
+            samples.append((self.name + '_sum', self.labels, key, total))
+            samples.append((self.name + '_count', self.labels, key, cumulative))
+        return samples
+
+
+registry = []
+
+
+def render():
+    return '\n'.join(metric.render() for metric in registry) + '\n'
+
+
+request_latency = Histogram(
+    'ftt_request_duration_seconds', 'Time spent serving a request.',
+    ('endpoint', 'method'))
+requests_served = Counter(
+    'ftt_requests_total', 'Requests served, by response status.',
+    ('endpoint', 'method', 'status'))
+request_queries = Counter(
+    'ftt_request_queries_total', 'SQL statements run while serving requests.', ('endpoint',))
+cache_requests = Counter(
+    'ftt_cache_requests_total', 'Cache lookups by view: hit, miss or not_modified.',
+    ('view', 'result'))
+db_connection_held = Histogram(
+    'ftt_db_connection_held_seconds',
+    'Time a pooled database connection is checked out before it is returned.')
+_checked_out = [0]
+_pool_lock = threading.Lock()
+db_connections_checked_out = Gauge(
+    'ftt_db_connections_checked_out', 'Database connections checked out of the pool.',
+    lambda: {(): _checked_out[0]})
+
+
+def observe_request(endpoint, method, status, duration, queries):
+    endpoint = endpoint or 'unmatched'
+    request_latency.observe(duration, endpoint=endpoint, method=method)
+    requests_served.inc(endpoint=endpoint, method=method, status=status)
+    request_queries.inc(queries, endpoint=endpoint)
+
+
+def cache_lookup(view, result):
+    cache_requests.inc(view=view, result=result)
+
+
+@event.listens_for(Pool, 'checkout')
+def _checkout(dbapi_connection, record, proxy):
+    record.info['checked_out'] = time.perf_counter()
+    with _pool_lock:
+        _checked_out[0] += 1
+
+
+@event.listens_for(Pool, 'checkin')
+def _checkin(dbapi_connection, record):
+    start = record.info.pop('checked_out', None)
+    if start is not None:
+        with _pool_lock:
+            _checked_out[0] -= 1
+        db_connection_held.observe(time.perf_counter() - start)
@@ -1,9 +1,13 @@
-from app import db, app, login
+from app import db, app
+from app.seeding import MAX_BRACKET_SIZE
 from sqlalchemy.ext.declarative import declarative_base
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
+from datetime import datetime
 from time import time
+import json
 import jwt
+import math
 from enum import Enum
 
 class Stage(Enum):
@@ -28,6 +32,8 @@ Base = declarative_base()
 
 class AccessTable(db.Model):
     __tablename__ = 'access_table'
+    __table_args__ = (
+        db.Index('ix_access_table_user_tournament', 'user_id', 'tournament_id'),)
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     tournament_id = db.Column(db.Integer, db.ForeignKey('tournament.id'))
@@ -69,10 +75,6 @@ class User(UserMixin, db.Model):
             return
         return User.query.get(id)
 
-@login.user_loader
-def load_user(id):
-    return User.query.get(int(id))
-
 class Tournament(db.Model):
     __tablename__ = 'tournament'
     id = db.Column(db.Integer, primary_key=True)
@@ -80,10 +82,16 @@ class Tournament(db.Model):
     #format = db.Column(db.String())
     organizers = db.relationship('AccessTable', backref='tournament')
     events = db.relationship('Event', backref='tournament', lazy='dynamic')
+    version = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    modified = db.Column(db.DateTime)
 
     def __repr__(self):
         return '<Tournament {}>'.format(self.name)
 
+    def touch(self):  # invalidates cached pages of this tournament
+        self.version = Tournament.version + 1
+        self.modified = datetime.utcnow()
+
 class Event(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(64))
@@ -91,22 +99,41 @@ class Event(db.Model):
     stage = db.Column(db.Integer, default=3)  # see stage enum
     num_fencers = db.Column(db.Integer, default=0)
     num_fencers_checked_in = db.Column(db.Integer, default=0)
-    tableau_json = db.Column(db.String(1024))
-    tournament_id = db.Column(db.Integer, db.ForeignKey('tournament.id'))
+    tournament_id = db.Column(db.Integer, db.ForeignKey('tournament.id'), index=True)
     weapon = db.Column(db.String(5))
+    de_cut = db.Column(db.Integer, default=12, server_default='12')  # teams advancing to DEs
+    de_cut_is_percent = db.Column(db.Boolean, default=False, server_default='0')
+    version = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    modified = db.Column(db.DateTime)
     pools = db.relationship('Pool', backref='event', lazy='dynamic')
     des = db.relationship('DE', backref='event', lazy='dynamic')
     fencers = db.relationship('Fencer', backref='event', lazy='dynamic')
+    standings = db.relationship('Standing', backref='event', lazy='dynamic')
+    de_rounds = db.relationship('DERound', backref='event', lazy='dynamic')
 
     def __repr__(self):
         return '<Event {}>'.format(self.name)
 
     def advance_stage(self, next_stage):
-        self.stage = next_stage.value if next_stage.value == self.stage+1 else self.stage
+        if next_stage.value == self.stage+1:
+            self.stage = next_stage.value
+            db.session.add(LiveUpdate(event_id=self.id, kind='stage', data=json.dumps(
+                {'stage': self.stage, 'name': stage_to_string(self.stage)})))
 
     def is_stage(self, stage):
         return self.stage == stage.value
 
+    def de_cut_size(self, num_teams):
+        cut = self.de_cut or 12
+        if self.de_cut_is_percent:
+            cut = int(math.ceil(num_teams * cut / 100.0))
+        return min(max(cut, 2), num_teams, MAX_BRACKET_SIZE)
+
+    def touch(self):  # invalidates cached pages of this event and its tournament
+        self.version = Event.version + 1
+        self.modified = datetime.utcnow()
+        self.tournament.touch()
+
 class Club(db.Model): #also university
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(120))
@@ -117,6 +144,10 @@ class Club(db.Model): #also university
         return '<Club {}>'.format(self.name)
 
 class Team(db.Model):
+    __table_args__ = (
+        db.UniqueConstraint('Event', 'name'),
+        db.Index('ix_team_event_checked_in', 'Event', 'is_checked_in'),
+        db.Index('ix_team_pool_num', 'Pool', 'num_in_pool'))
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(64))
     fencers = db.relationship('Fencer', backref='team_members', lazy='dynamic')
@@ -140,6 +171,8 @@ class Team(db.Model):
 
 
 class Pool(db.Model):
+    __table_args__ = (
+        db.UniqueConstraint('event_id', 'poolNum', 'pool_letter'),)
     id = db.Column(db.Integer, primary_key=True)
     poolNum = db.Column(db.Integer)
     event_id = db.Column(db.Integer, db.ForeignKey('event.id'))
@@ -156,6 +189,8 @@ class Pool(db.Model):
 
 class DE(db.Model):
     __tablename__ = 'de'
+    __table_args__ = (
+        db.Index('ix_de_event_round_state', 'event_id', 'round', 'state'),)
     id = db.Column(db.Integer, primary_key=True)
     state = db.Column(db.Integer)  # 0 = not started, 1 = in progress, 2 = finished, 3 = bye, 4 = tbd
     is_third = db.Column(db.Boolean, default=False)
@@ -168,15 +203,41 @@ class DE(db.Model):
     team1 = db.relationship('Team', foreign_keys=[team1_id])
     team2_id = db.Column(db.Integer, db.ForeignKey('team.id'), default=None)
     team2 = db.relationship('Team', foreign_keys=[team2_id])
+    seed1 = db.Column(db.Integer)  # DE seeding of the teams, first round only
+    seed2 = db.Column(db.Integer)
     fencer1_score = db.Column(db.Integer)
     fencer2_score = db.Column(db.Integer)
     fencer1_win = db.Column(db.Boolean)
     event_id = db.Column(db.Integer, db.ForeignKey('event.id'))
+    match_num = db.Column(db.Integer)  # 1 = final, 2-3 = semifinals, ...
+    next_de_id = db.Column(db.Integer, db.ForeignKey('de.id'))
+    next_de = db.relationship('DE', remote_side=[id], foreign_keys=[next_de_id])
+    next_slot = db.Column(db.Integer)  # 1 = team1, 2 = team2 of next_de
+    loser_de_id = db.Column(db.Integer, db.ForeignKey('de.id'))
+    loser_de = db.relationship('DE', remote_side=[id], foreign_keys=[loser_de_id])
+    loser_slot = db.Column(db.Integer)
 
     def __repr__(self):
         return '<DE {} {} vs {}>'.format(self.id, self.fencer1, self.fencer2)
 
+
+class DERound(db.Model):  # completion counter for one round of an event's DEs
+    __tablename__ = 'de_round'
+    __table_args__ = (
+        db.Index('ix_de_round_event_round', 'event_id', 'round'),)
+    id = db.Column(db.Integer, primary_key=True)
+    event_id = db.Column(db.Integer, db.ForeignKey('event.id'))
+    round = db.Column(db.Integer)
+    bouts = db.Column(db.Integer, default=0)
+    finished = db.Column(db.Integer, default=0)
+
+    def __repr__(self):
+        return '<DERound {} {}/{}>'.format(self.round, self.finished, self.bouts)
+
 class Result(db.Model):
+    __table_args__ = (
+        db.Index('ix_result_pool_teams', 'pool_id', 'team_id', 'opponent_team_id'),
+        db.Index('ix_result_teams', 'team_id', 'opponent_team_id'))
     id = db.Column(db.Integer, primary_key=True)
     event_id = db.Column(db.Integer, db.ForeignKey('event.id'))
     pool_id = db.Column(db.Integer, db.ForeignKey('pool.id'))
@@ -198,7 +259,43 @@ class Result(db.Model):
             return '<Result {} vs {} {} touches {}>'.format(self.team, self.opponent_team, self.fencer_score, self.fencer_win)
     
 
+class LiveUpdate(db.Model):  # change pushed to spectators following an event
+    __tablename__ = 'live_update'
+    id = db.Column(db.Integer, primary_key=True)
+    event_id = db.Column(db.Integer, db.ForeignKey('event.id'), index=True)
+    kind = db.Column(db.String(16))
+    data = db.Column(db.Text)
+    created = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    def __repr__(self):
+        return '<LiveUpdate {} {} {}>'.format(self.id, self.event_id, self.kind)
+
+
+class Standing(db.Model):  # pool ranking of a team, maintained as results are written
+    __table_args__ = (
+        db.Index('ix_standing_event_place', 'event_id', 'place'),
+        db.UniqueConstraint('event_id', 'team_id'))
+    id = db.Column(db.Integer, primary_key=True)
+    event_id = db.Column(db.Integer, db.ForeignKey('event.id'))
+    team_id = db.Column(db.Integer, db.ForeignKey('team.id'))
+    team = db.relationship('Team', foreign_keys=[team_id])
+    win_percent = db.Column(db.Float, default=0)
+    indicator = db.Column(db.Integer, default=0)
+    touches_scored = db.Column(db.Integer, default=0)
+    place = db.Column(db.Integer)
+    is_tied = db.Column(db.Boolean, default=False)
+
+    def __repr__(self):
+        return '<Standing {} {} {}>'.format(self.place_string(), self.team_id, self.win_percent)
+
+    def place_string(self):
+        return str(self.place) + ('T' if self.is_tied else '')
+
+
 class Fencer(db.Model):
+    __table_args__ = (
+        db.Index('ix_fencer_pool_num', 'pool_id', 'num_in_pool'),
+        db.Index('ix_fencer_team_position', 'team_id', 'team_position'))
     id = db.Column(db.Integer, primary_key=True)
     first_name = db.Column(db.String(32), index=True)
     last_name = db.Column(db.String(32), index=True)
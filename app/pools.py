@@ -0,0 +1,277 @@
+from collections import defaultdict
+
+from sqlalchemy import bindparam
+
+from app import app, db
+from app.models import Fencer, Team, Pool, Result
+from app.assignment import optimize_pools
+from app.queries import bakery, execute_compiled
+from app.standings import update_standings, win_percent
+
+
+def create_event_pools(event, sizes):
+    """Create the A, B, C and team (O) pools of an event and seat its teams.
+
+    `sizes` holds the number of teams of each pool in poolNum order.
+    Checked-in teams are placed by optimize_pools and their first three
+    fencers seated in the A, B and C pools. The pools are bulk inserted and
+    the memberships written with one executemany UPDATE each for teams and
+    fencers. Returns the PoolAssignment.
+
+    Pools are unique per (event, poolNum, letter), so the event's pools read
+    back after the insert are the ones just written; a second, concurrent
+    create fails on the constraint instead.
+    """
+    db.session.bulk_insert_mappings(Pool, [
+        dict(event_id=event.id, num_fencers=size, poolNum=i + 1, pool_letter=letter)
+        for i, size in enumerate(sizes) for letter in 'ABCO'])
+    pools = defaultdict(dict)
+    for id, pool_num, letter in db.session.query(Pool.id, Pool.poolNum, Pool.pool_letter)\
+            .filter(Pool.event_id == event.id):
+        pools[pool_num][letter] = id
+
+    checked_in = (Team.event_id == event.id, Team.is_checked_in == True)
+    teams = db.session.query(Team.id, Team.club_id).filter(*checked_in)\
+        .order_by(Team.id.asc()).all()
+    fencers = defaultdict(list)
+    for id, team_id in db.session.query(Fencer.id, Fencer.team_id)\
+            .join(Team, Fencer.team_id == Team.id).filter(*checked_in)\
+            .order_by(Fencer.team_position.asc()):
+        fencers[team_id].append(id)
+
+    assignment = optimize_pools(teams, sizes, app.config['POOL_ASSIGNMENT_BUDGET'])
+    seats, members = [], []
+    for pool_num, team_ids in enumerate(assignment.pools, 1):
+        for num_in_pool, team_id in enumerate(team_ids, 1):
+            seats.append(dict(id=team_id, pool_id=pools[pool_num]['O'],
+                              num_in_pool=num_in_pool))
+            for letter, fencer_id in zip('ABC', fencers[team_id]):
+                members.append(dict(id=fencer_id, pool_id=pools[pool_num][letter],
+                                    num_in_pool=num_in_pool))
+    db.session.bulk_update_mappings(Team, seats)
+    db.session.bulk_update_mappings(Fencer, members)
+    return assignment
+
+
+def reassign_pools(event, layout):
+    """Apply a pool assignment layout, writing only what changed.
+
+    `layout` maps a pool index (poolNum - 1) to the teams of that pool in
+    order, given by id or, for older clients, by name. Teams and their A, B
+    and C fencers that moved are written with one executemany UPDATE each,
+    then every pool's num_fencers is recounted once. Raises KeyError for an
+    unknown pool or team.
+    """
+    pools, sizes = {}, {}
+    for id, pool_num, letter, num_fencers in db.session.query(
+            Pool.id, Pool.poolNum, Pool.pool_letter, Pool.num_fencers)\
+            .filter(Pool.event_id == event.id):
+        pools[(pool_num, letter)] = id
+        sizes[id] = num_fencers
+    teams = {}
+    ids = {}
+    for id, name, pool_id, num_in_pool in db.session.query(
+            Team.id, Team.name, Team.pool_id, Team.num_in_pool)\
+            .filter(Team.event_id == event.id):
+        teams[id] = [pool_id, num_in_pool]
+        ids.setdefault(name, id)
+    fencers = defaultdict(list)
+    for row in db.session.query(Fencer.id, Fencer.team_id, Fencer.team_position,
+                                Fencer.pool_id, Fencer.num_in_pool)\
+            .join(Team, Fencer.team_id == Team.id)\
+            .filter(Team.event_id == event.id, Fencer.team_position != 'D'):
+        fencers[row.team_id].append([row.id, row.team_position, row.pool_id,
+                                     row.num_in_pool])
+
+    team_moves, fencer_moves = [], []
+    for index, members in layout.items():
+        pool_num = int(index) + 1
+        for num_in_pool, team in enumerate(members, 1):
+            team_id = team if isinstance(team, int) else ids[team]
+            seat = [pools[(pool_num, 'O')], num_in_pool]
+            if teams[team_id] != seat:
+                teams[team_id] = seat
+                team_moves.append(dict(id=team_id, pool_id=seat[0], num_in_pool=num_in_pool))
+            for fencer in fencers[team_id]:
+                seat = [pools[(pool_num, fencer[1])], num_in_pool]
+                if fencer[2:] != seat:
+                    fencer[2:] = seat
+                    fencer_moves.append(dict(id=fencer[0], pool_id=seat[0],
+                                             num_in_pool=num_in_pool))
+    db.session.bulk_update_mappings(Team, team_moves)
+    db.session.bulk_update_mappings(Fencer, fencer_moves)
+
+    counts = defaultdict(int)
+    for pool_id, _ in teams.values():
+        counts[pool_id] += 1
+    for members in fencers.values():
+        for fencer in members:
+            counts[fencer[2]] += 1
+    db.session.bulk_update_mappings(Pool, [
+        dict(id=id, num_fencers=counts[id]) for id, size in sizes.items()
+        if size != counts[id]])
+
+
+def parse_pool_sheet(form):
+    # maps (num_in_pool, opponent_num_in_pool) -> raw score for every cell
+    sheet = {}
+    for key, value in form.items():
+        key = key.strip('result')
+        sheet[(int(key[0]), int(key[1]))] = value
+    return sheet
+
+
+def _delta_update(table):
+    # adds each row's deltas to its current values, run as one executemany
+    columns = ['victories', 'touches_scored', 'touches_recieved', 'indicator']
+    return table.update()\
+        .where(table.c.id == bindparam('_id'))\
+        .values({c: table.c[c] + bindparam('_' + c) for c in columns})
+
+
+_add_fencer_deltas = _delta_update(Fencer.__table__)
+_add_team_deltas = _delta_update(Team.__table__)
+
+
+def _add_deltas(statement, deltas):
+    if not deltas:
+        return
+    execute_compiled(statement, [
+        dict({'_id': id}, **{'_' + column: change for column, change in delta.items()})
+        for id, delta in deltas.items()])
+
+
+_pool_team_results = bakery(lambda session: session.query(Result).filter(
+    Result.team_id.in_(bindparam('team_ids', expanding=True)),
+    Result.opponent_team_id.in_(bindparam('team_ids', expanding=True))))
+
+
+def _zero_deltas():
+    return dict(victories=0, touches_scored=0, touches_recieved=0, indicator=0)
+
+
+def record_pool_results(pool, scores):
+    """Write a validated pool sheet with a fixed number of statements.
+
+    `scores` maps (num_in_pool, opponent_num_in_pool) to the Score of the
+    fencer in that row. Fencer and team aggregates are applied as deltas and
+    team bouts are won once a team takes two of its three individual bouts.
+    """
+    fencers = {fencer.num_in_pool: fencer for fencer in
+               pool.fencers.options(db.joinedload(Fencer.team))}
+    if not fencers:
+        return
+    team_pool_id = next(iter(fencers.values())).team.pool_id
+    team_ids = {fencer.team_id for fencer in fencers.values()}
+
+    team_results = {}
+    wins = defaultdict(int)
+    for result in _pool_team_results(db.session()).params(team_ids=list(team_ids)):
+        pair = (result.team_id, result.opponent_team_id)
+        if result.pool_id == team_pool_id:
+            team_results[pair] = result
+        elif result.fencer_win:
+            wins[pair] += 1
+
+    fencer_deltas = defaultdict(_zero_deltas)
+    team_deltas = defaultdict(_zero_deltas)
+    team_scores = defaultdict(int)
+    rows = []
+    for (i, j), score in scores.items():
+        fencer, opponent = fencers[i], fencers[j]
+        pair = (fencer.team_id, opponent.team_id)
+        rows.append(dict(
+            pool_id=pool.id,
+            event_id=pool.event_id,
+            fencer=fencer.id,
+            team_id=fencer.team_id,
+            fencer_score=score.touches,
+            opponent=opponent.id,
+            opponent_team_id=opponent.team_id,
+            fencer_win=score.is_winner()))
+        for deltas, (id, opponent_id) in ((fencer_deltas, (fencer.id, opponent.id)),
+                                          (team_deltas, pair)):
+            deltas[id]['touches_scored'] += score.touches
+            deltas[id]['indicator'] += score.touches
+            deltas[opponent_id]['touches_recieved'] += score.touches
+            deltas[opponent_id]['indicator'] -= score.touches
+        fencer_deltas[fencer.id]['victories'] += 1 if score.is_winner() else 0
+        wins[pair] += 1 if score.is_winner() else 0
+        team_scores[pair] += score.touches
+
+    updates = []
+    for pair, touches in team_scores.items():
+        team_result = team_results.get(pair)
+        won = (team_result is not None and team_result.fencer_win) or wins[pair] >= 2
+        if won and not (team_result is not None and team_result.fencer_win):
+            team_deltas[pair[0]]['victories'] += 1
+        if team_result is not None:
+            updates.append(dict(
+                id=team_result.id,
+                fencer_score=team_result.fencer_score + touches,
+                fencer_win=won))
+        else:
+            rows.append(dict(
+                pool_id=team_pool_id,
+                event_id=None,
+                fencer=None,
+                team_id=pair[0],
+                fencer_score=touches,
+                opponent=None,
+                opponent_team_id=pair[1],
+                fencer_win=won))
+
+    standings = {}
+    for fencer in fencers.values():
+        team, delta = fencer.team, team_deltas[fencer.team_id]
+        standings[team.id] = dict(
+            win_percent=win_percent(team.victories + delta['victories'],
+                                    team.pool.num_fencers),
+            indicator=team.indicator + delta['indicator'],
+            touches_scored=team.touches_scored + delta['touches_scored'])
+
+    db.session.bulk_insert_mappings(Result, rows)
+    db.session.bulk_update_mappings(Result, updates)
+    _add_deltas(_add_fencer_deltas, fencer_deltas)
+    _add_deltas(_add_team_deltas, team_deltas)
+    update_standings(pool.event_id, standings)
+
+
+class PoolMatrix():
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.teams = []
+        # results[row][column] is the team result of the team numbered row + 1
+        # against the team numbered column + 1, or None if not fenced yet
+        self.results = [[None] * pool.num_fencers for _ in range(pool.num_fencers)]
+
+    def result(self, row, column):  # 1-based, like num_in_pool
+        return self.results[row - 1][column - 1]
+
+
+def pool_matrices(event, pool_num=None):
+    """Build a PoolMatrix for each team pool of the event, keyed by poolNum.
+
+    Uses one query for the pools, one for their teams and one joined query
+    for every team result, however many pools and teams there are.
+    """
+    q = event.pools.filter_by(pool_letter='O')
+    if pool_num is not None:
+        q = q.filter_by(poolNum=pool_num)
+    pools = {pool.id: PoolMatrix(pool) for pool in q}
+    if not pools:
+        return {}
+    for team in Team.query.filter(Team.pool_id.in_(list(pools)))\
+            .order_by(Team.num_in_pool.asc()):
+        pools[team.pool_id].teams.append(team)
+    opponent = db.aliased(Team)
+    q = db.session.query(Result, Team.num_in_pool, opponent.num_in_pool)\
+        .join(Team, Result.team_id == Team.id)\
+        .join(opponent, Result.opponent_team_id == opponent.id)\
+        .filter(Result.pool_id.in_(list(pools)), Result.fencer == None)
+    for result, row, column in q:
+        matrix = pools[result.pool_id]
+        if 0 < row <= len(matrix.results) and 0 < column <= len(matrix.results):
+            matrix.results[row - 1][column - 1] = result
+    return {matrix.pool.poolNum: matrix for matrix in pools.values()}
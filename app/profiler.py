@@ -0,0 +1,154 @@
+from collections import Counter
+import gc
+import os
+import sys
+import time
+import weakref
+
+from app import app
+
+try:  # under gunicorn's gevent worker the sampler still needs a real thread
+    from gevent.monkey import get_original
+    _start_thread, _get_ident, _allocate_lock = get_original(
+        '_thread', ['start_new_thread', 'get_ident', 'allocate_lock'])
+    _sleep = get_original('time', 'sleep')
+except ImportError:
+    from _thread import start_new_thread as _start_thread, get_ident as _get_ident, \
+        allocate_lock as _allocate_lock
+    from time import sleep as _sleep
+
+try:
+    from greenlet import getcurrent, greenlet as _greenlet
+except ImportError:
+    getcurrent = None
+
+_dispatch_code = type(app).dispatch_request.__code__
+
+
+def _frame_name(code):
+    path = code.co_filename.split(os.sep)
+    return '{} ({}:{})'.format(code.co_name, '/'.join(path[-2:]), code.co_firstlineno)
+
+
+def _request_stack(frame):
+    # (endpoint, frames from the view down) of a thread serving a request
+    frames = []
+    while frame is not None:
+        if frame.f_code is _dispatch_code:
+            rule = frame.f_locals['req'].url_rule
+            endpoint = rule.endpoint if rule is not None else 'unknown'
+            return endpoint, tuple(reversed(frames))
+        frames.append(_frame_name(frame.f_code))
+        frame = frame.f_back
+    return None, None
+
+
+class Sampler():
+    """Wall-clock stack sampler, switched on for a window of time.
+
+    While running, a background thread looks at the stack of every thread
+    serving a request `rate` times a second and counts each distinct stack
+    per route. Samples stay in memory, per process, until the next start().
+
+    Under the gevent worker every request is a greenlet on one thread, and
+    sys._current_frames() only shows the greenlet running at that moment.
+    The greenlets of requests are therefore tracked too: those in flight
+    when sampling starts are found once through the garbage collector and
+    later ones as their request begins. The frames of those suspended on
+    I/O are sampled with the rest, so waits count as they do for threads.
+    When off, this costs each request one attribute check.
+    """
+
+    def __init__(self, max_stacks=20000):
+        self.max_stacks = max_stacks
+        self.lock = _allocate_lock()
+        self.stacks = Counter()
+        self.greenlets = weakref.WeakSet()  # request greenlets, found by track()
+        self.samples = 0
+        self.dropped = 0
+        self.rate = None
+        self.started = None
+        self.until = 0
+        self.running = False
+
+    def start(self, seconds, rate):
+        with self.lock:
+            self.stacks = Counter()
+            self.samples = self.dropped = 0
+            self.rate = rate
+            self.started = time.time()
+            self.until = time.time() + seconds
+            if getcurrent is not None:
+                self.greenlets = weakref.WeakSet(
+                    obj for obj in gc.get_objects() if isinstance(obj, _greenlet))
+            if not self.running:
+                self.running = True
+                _start_thread(self._run, ())
+
+    def stop(self):
+        with self.lock:
+            self.until = 0
+
+    def track(self):
+        # remembers the greenlet serving this request while sampling
+        if self.running and getcurrent is not None:
+            with self.lock:
+                self.greenlets.add(getcurrent())
+
+    def _frames(self, me):
+        # the top frame of every other thread and of every suspended greenlet;
+        # a running greenlet has no gr_frame and shows up as its thread
+        frames = [frame for ident, frame in sys._current_frames().items() if ident != me]
+        with self.lock:
+            greenlets = list(self.greenlets)
+        frames.extend(g.gr_frame for g in greenlets if g.gr_frame is not None)
+        return frames
+
+    def _run(self):
+        me = _get_ident()
+        while True:
+            with self.lock:
+                if time.time() >= self.until:
+                    self.running = False
+                    return
+            for frame in self._frames(me):
+                self._sample(frame)
+            _sleep(1.0 / self.rate)
+
+    def _sample(self, frame):
+        endpoint, stack = _request_stack(frame)
+        if endpoint is None:
+            return
+        key = (endpoint,) + stack
+        with self.lock:
+            self.samples += 1
+            if key in self.stacks or len(self.stacks) < self.max_stacks:
+                self.stacks[key] += 1
+            else:
+                self.dropped += 1
+
+    def status(self):
+        with self.lock:
+            routes = Counter()
+            for key, count in self.stacks.items():
+                routes[key[0]] += count
+            return dict(running=self.running, rate=self.rate, started=self.started,
+                        remaining=max(0, round(self.until - time.time(), 1)),
+                        samples=self.samples, dropped=self.dropped,
+                        routes=dict(routes.most_common()))
+
+    def collapsed(self, endpoint=None):
+        # one "route;frame;...;frame count" line per stack, as read by
+        # flamegraph.pl and speedscope
+        with self.lock:
+            items = sorted(self.stacks.items(), key=lambda item: -item[1])
+        return ''.join('{} {}\n'.format(';'.join(key), count) for key, count in items
+                       if endpoint is None or key[0] == endpoint)
+
+
+sampler = Sampler(app.config['PROFILER_MAX_STACKS'])
+
+
+@app.before_request
+def track_request_greenlet():
+    sampler.track()
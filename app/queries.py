@@ -0,0 +1,19 @@
+from sqlalchemy.ext import baked
+
+from app import db
+
+# Baked queries cache their SQL by the lambdas that build them, so hot
+# reads are built and compiled once per process with bound parameters.
+bakery = baked.bakery()
+
+_compiled = {}
+
+
+def execute_compiled(statement, params):
+    # runs a module-level Core statement, compiling it once per dialect
+    connection = db.session.connection()
+    key = (statement, connection.dialect)
+    compiled = _compiled.get(key)
+    if compiled is None:
+        compiled = _compiled[key] = statement.compile(dialect=connection.dialect)
+    return connection.execute(compiled, params)
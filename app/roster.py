@@ -0,0 +1,154 @@
+import codecs
+import csv
+from itertools import chain
+import json
+
+from app import app, db
+from app.models import Club, Fencer, Team
+
+POSITIONS = ['A', 'B', 'C', 'D']
+MAX_ERRORS = 50
+
+
+class RosterError(ValueError):
+
+    def __init__(self, errors):
+        ValueError.__init__(self, '{} problems in the roster'.format(len(errors)))
+        self.errors = errors  # (line, message) pairs
+
+
+def _records(stream, filename):
+    # (line, dict) for each row of a CSV or JSON upload. CSV and JSON lines
+    # are parsed as they are read; a JSON array has to be loaded whole.
+    text = codecs.getreader('utf-8-sig')(stream)
+    if not filename.lower().endswith('.json'):
+        reader = csv.DictReader(text)
+        reader.fieldnames = [name.strip().lower() for name in reader.fieldnames or []]
+        for record in reader:
+            yield reader.line_num, record
+        return
+    skipped = 0
+    first = text.readline()
+    while first and not first.strip():
+        skipped += 1
+        first = text.readline()
+    if first.lstrip().startswith('['):
+        for i, record in enumerate(json.loads(first + text.read()), 1):
+            yield i, record
+        return
+    for line, data in enumerate(chain([first], text), skipped + 1):
+        if data.strip():
+            yield line, json.loads(data)
+
+
+def _name(value):
+    # "First Last" as entered in AddTeamForm, or None for an empty slot
+    value = (value or '').strip()
+    if not value:
+        return None
+    parts = value.split()
+    if len(parts) != 2 or not value.replace(' ', '').isalpha() or len(value) > 64:
+        raise ValueError('Fencer name must be a first and last name of letters only.')
+    return parts[0].title(), parts[1].title()
+
+
+def _checked_in(value):
+    if value is None or value == '' or value is True or value is False:
+        return value is not False
+    value = str(value).strip().lower()
+    if value in ('1', 'true', 'yes', 'y'):
+        return True
+    if value in ('0', 'false', 'no', 'n'):
+        return False
+    raise ValueError('checked_in must be yes or no.')
+
+
+def parse_roster(stream, filename):
+    """Read and validate a roster upload, one team per row.
+
+    Rows have team, club, fencer_a and fencer_b and optionally fencer_c,
+    fencer_d and checked_in (yes by default). Every row is checked before
+    anything is written; all problems are raised together as a RosterError.
+    Names already in the event are left to the database to reject.
+    """
+    teams, errors = [], []
+    names = set()
+    try:
+        for line, record in _records(stream, filename):
+            if not isinstance(record, dict):
+                errors.append((line, 'Each team must be an object with named fields.'))
+                continue
+            record = {str(k).strip().lower(): v for k, v in record.items() if k is not None}
+            name = str(record.get('team') or '').strip()
+            club = str(record.get('club') or '').strip()
+            try:
+                if not name or len(name) > 64:
+                    raise ValueError('A team name of at most 64 characters is required.')
+                if name in names:
+                    raise ValueError('Team {} appears twice.'.format(name))
+                if club not in app.config['UNIVERSITIES']:
+                    raise ValueError('Unknown university {!r}.'.format(club))
+                fencers = [_name(record.get('fencer_' + p.lower())) for p in POSITIONS]
+                if fencers[0] is None or fencers[1] is None:
+                    raise ValueError('Fencers A and B are required.')
+                checked_in = _checked_in(record.get('checked_in'))
+            except ValueError as e:
+                errors.append((line, str(e)))
+            else:
+                names.add(name)
+                teams.append(dict(name=name, club=club, fencers=fencers,
+                                  is_checked_in=checked_in))
+            if len(errors) >= MAX_ERRORS:
+                break
+    except (ValueError, csv.Error, UnicodeDecodeError) as e:  # unreadable file
+        errors.append((None, 'The file could not be read: {}'.format(e)))
+    if errors:
+        raise RosterError(errors)
+    if not teams:
+        raise RosterError([(None, 'The file has no teams.')])
+    return teams
+
+
+def import_teams(event, teams):
+    """Register parsed roster rows in `event` with bulk inserts.
+
+    Clubs are resolved through one lookup and missing ones flushed one by
+    one; there are at most as many as UNIVERSITIES, and only the first
+    import of each creates it. The teams and all four fencer slots of
+    each (empty C and D slots as placeholders, like edit_registration)
+    are written with one insert per table. Team names are unique within
+    an event, so the event's teams read back afterwards map each name to
+    the row just written; a name registered meanwhile fails the insert
+    with an IntegrityError. The caller commits.
+    """
+    clubs = {name: id for id, name in db.session.query(Club.id, Club.name)
+             .filter(Club.name.in_({team['club'] for team in teams}))}
+    missing = [Club(name=name) for name in sorted({team['club'] for team in teams} - set(clubs))]
+    if missing:
+        db.session.add_all(missing)
+        db.session.flush()
+        clubs.update((club.name, club.id) for club in missing)
+
+    db.session.bulk_insert_mappings(Team, [
+        dict(name=team['name'], is_checked_in=team['is_checked_in'],
+             event_id=event.id, club_id=clubs[team['club']])
+        for team in teams])
+    ids = {name: id for id, name in db.session.query(Team.id, Team.name)
+           .filter(Team.event_id == event.id)}
+
+    fencers = []
+    for team in teams:
+        for position, name in zip(POSITIONS, team['fencers']):
+            if name is None:
+                fencers.append(dict(first_name='', last_name='', team_position=position,
+                                    team_id=ids[team['name']], event_id=None))
+            else:
+                fencers.append(dict(first_name=name[0], last_name=name[1],
+                                    team_position=position, team_id=ids[team['name']],
+                                    event_id=event.id))
+    db.session.bulk_insert_mappings(Fencer, fencers, render_nulls=True)
+
+    checked_in = sum(1 for team in teams if team['is_checked_in'])
+    event.num_fencers = event.num_fencers + len(teams)
+    event.num_fencers_checked_in = event.num_fencers_checked_in + checked_in
+    event.touch()
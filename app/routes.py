@@ -1,30 +1,96 @@
+from collections import defaultdict
 from datetime import datetime
+from functools import wraps
+import hashlib
 from urllib.parse import urlparse
 import json
 from json import JSONDecodeError
-import math
 from time import time
 import re
 
-from sqlalchemy import func
-from flask import render_template, flash, redirect, url_for, request
+from flask import render_template, flash, redirect, url_for, request, session, \
+                  Response, make_response, jsonify, stream_with_context, abort
+from werkzeug.utils import secure_filename
+from sqlalchemy.exc import IntegrityError
 from flask_login import login_user, logout_user, current_user, login_required
 from app import app, db, cache
-import flask_profiler
 
 from app.forms import *
 from app.models import *
-from app.utils import generate_tournament, quicksort, Score, is_valid_pair
-from app.email import send_password_reset_email, send_prereg_email
-
-TIMEOUT = 30  # seconds
-
-def is_to_of_tournament(user, tournament):
+from app.utils import Score, is_valid_pair
+from app.pools import create_event_pools, reassign_pools, parse_pool_sheet, \
+                      record_pool_results, pool_matrices
+from app.assignment import optimize_pools
+from app.auth import tournament_access, forget_user
+from app.database import read_only
+from app.instrumentation import query_budget
+from app.profiler import sampler
+from app.metrics import cache_lookup, render as render_metrics
+from app.standings import event_standings, refresh_standings
+from app.roster import parse_roster, import_teams, RosterError
+from app.listings import tournament_listing
+from app.export import SECTIONS, export_csv, export_ndjson
+from app.live import publish, pool_payload, event_stream
+from app.bracket import create_bracket, link_bracket, advance_team, finish_bout, \
+                        match_position, bracket_document, open_bouts, placed_teams
+from app.email import send_password_reset_email, send_prereg_email, prereg_tag, \
+                      mail_queue
+
+def is_to_of_tournament(user, tournament_id):
+    return tournament_id in tournament_access(user)
+
+
+def viewer_role(tournament_id):
     if current_user.is_anonymous:
-        return False
-    access = AccessTable.query.filter_by(
-        user_id=user.id, tournament_id=tournament.id).first()
-    return bool(access)
+        return 'public'
+    access = is_to_of_tournament(current_user, tournament_id)
+    return '{}-{}'.format('to' if access else 'user', current_user.id)
+
+
+def cached_by_version(f):
+    # Caches a public page until the event or tournament it shows is touched
+    # by a write. The key holds the data version and the viewer's role, so
+    # there is no timeout and TO and public views are kept apart. The same
+    # key is the page's ETag, so clients revalidating an unchanged page get
+    # a 304 after a single version lookup. Only the ETag is trusted for that:
+    # Last-Modified is in whole seconds and knows nothing of the viewer.
+    @wraps(f)
+    def decorated_function(**kwargs):
+        if 'event_id' in kwargs:
+            row = db.session.query(
+                Event.version, Event.modified, Event.tournament_id)\
+                .filter(Event.id == kwargs['event_id']).first()
+        else:
+            row = db.session.query(
+                Tournament.version, Tournament.modified, Tournament.id)\
+                .filter(Tournament.id == kwargs['tournament_id']).first()
+        if row is None or session.get('_flashes'):
+            return f(**kwargs)
+        version, modified, tournament_id = row
+        key = 'view/{}/{}/{}'.format(
+            request.path, version, viewer_role(tournament_id))
+        etag = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        if modified is not None:
+            modified = modified.replace(microsecond=0)
+        if request.if_none_match.contains(etag):
+            cache_lookup(f.__name__, 'not_modified')
+            response = Response(status=304)
+        else:
+            rv = cache.get(key)
+            cache_lookup(f.__name__, 'miss' if rv is None else 'hit')
+            if rv is None:
+                rv = f(**kwargs)
+                if not isinstance(rv, str):
+                    return rv
+                cache.set(key, rv, timeout=0)
+            response = make_response(rv)
+        response.set_etag(etag)
+        if modified is not None:
+            response.last_modified = modified
+        response.headers['Cache-Control'] = 'no-cache'
+        response.vary.add('Cookie')
+        return response
+    return decorated_function
 
 
 @app.route('/')
@@ -34,6 +100,7 @@ def index():
 
 
 @app.route('/login', methods=['GET', 'POST'])
+@query_budget(3)
 def login():
     if current_user.is_authenticated:
         return redirect(url_for('index'))
@@ -60,6 +127,7 @@ def logout():
 
 
 @app.route('/register', methods=['GET', 'POST'])
+@query_budget(5)
 def register():
     if current_user.is_authenticated:
         return redirect(url_for('index'))
@@ -80,20 +148,21 @@ def personal_user(username):
     user = User.query.filter_by(username=username).first_or_404()
     if user != current_user:
         return redirect(url_for('index'))
-    q = db.session.query(User, AccessTable, Tournament)\
-        .filter(AccessTable.user_id == user.id)\
-        .filter(Tournament.id == AccessTable.tournament_id).distinct()
-    q = [i for _, _, i in q]
+    tournaments, before = tournament_listing(
+        request.args.get('before', type=int), user_id=user.id)
     return render_template(
         'user.html',
         title=user.username,
         user=user,
-        tournaments=q,
+        tournaments=tournaments,
+        before=before,
         public=False)
 
 
 @app.route('/tournament/<int:tournament_id>')
-@cache.cached(timeout=TIMEOUT)
+@read_only
+@cached_by_version
+@query_budget(5)
 def public_tournament(tournament_id):
     tournament = Tournament.query.get_or_404(tournament_id)
     events = tournament.events
@@ -102,16 +171,20 @@ def public_tournament(tournament_id):
 
 
 @app.route('/explore')
+@read_only
+@query_budget(2)
 def explore():
-    tournaments = Tournament.query.all()
+    tournaments, before = tournament_listing(request.args.get('before', type=int))
     return render_template(
-        'explore.html', title='Explore', tournaments=tournaments, public=True)
+        'explore.html', title='Explore', tournaments=tournaments, before=before,
+        public=True)
 
 
 @app.route('/create-tournament', methods=['GET', 'POST'])
 @login_required
+@query_budget(7)
 def create_tournament():
-    user = User.query.filter_by(username=current_user.username).first()
+    user = current_user
     form = CreateTournamentForm()
     if form.validate_on_submit():
         tournament = Tournament(name=form.name.data.title())
@@ -121,6 +194,7 @@ def create_tournament():
         tournament.organizers.append(access)
         db.session.add(tournament)
         db.session.commit()
+        forget_user(user.id)
         flash('Created new tournament.')
         return redirect(url_for('personal_user', username=current_user.username))
     return render_template(
@@ -130,9 +204,10 @@ def create_tournament():
 @app.route(
     '/tournament/<int:tournament_id>/create-event', methods=['GET', 'POST'])
 @login_required
+@query_budget(8)
 def create_event(tournament_id):
     tournament = Tournament.query.get_or_404(tournament_id)
-    if not is_to_of_tournament(current_user, tournament):
+    if not is_to_of_tournament(current_user, tournament.id):
         return redirect(url_for('index'))
     form = CreateEventForm()
     if form.validate_on_submit():
@@ -141,9 +216,12 @@ def create_event(tournament_id):
             date=datetime.strptime(
                 form.date.data.strftime('%m/%d/%Y'), '%m/%d/%Y'),
             weapon=form.weapon.data,
+            de_cut=form.de_cut.data,
+            de_cut_is_percent=(form.de_cut_type.data == 'percent'),
             tournament=tournament)
         tournament.events.append(event)
         db.session.add(event)
+        tournament.touch()
         db.session.commit()
         flash('Created new event.')
         return redirect(url_for('personal_user', username=current_user.username))
@@ -158,7 +236,8 @@ def create_event_default(tournament_id):
 
 
 @app.route('/event/<int:event_id>/registration')
-@cache.cached(timeout=TIMEOUT)
+@read_only
+@cached_by_version
 def registration(event_id):
     event = Event.query.get_or_404(event_id)
     title = 'Registration'
@@ -167,49 +246,28 @@ def registration(event_id):
 
 
 @app.route('/event/<int:event_id>/initial-seeding')
+@read_only
+@cached_by_version
 def initial_seeding(event_id):
     event = Event.query.get_or_404(event_id)
     teams = event.teams.filter_by(is_checked_in=True)
-    public = not is_to_of_tournament(current_user, event.tournament)
+    public = not is_to_of_tournament(current_user, event.tournament_id)
     return render_template(
         'initial-seed-teams.html', event=event, teams=teams,
         public=public)
 
 
 @app.route('/event/<int:event_id>/pool-results')
+@read_only
+@cached_by_version
+@query_budget(5)
 def pool_results(event_id):
     event = Event.query.get_or_404(event_id)
     public = True
-    if is_to_of_tournament(current_user, event.tournament):
+    if is_to_of_tournament(current_user, event.tournament_id):
         public = False
-    teams = db.engine.execute(
-        """SELECT t.id, (t.victories*1.0 / (p.num_fencers - 1)) as winPercent
-        FROM team t JOIN pool p ON t.Pool = p.id
-        WHERE t.is_checked_in = 1 AND t.Event = {}
-        ORDER BY winPercent DESC, t.indicator DESC, t.touches_scored DESC;
-        """.format(event_id))
-    teams = [[Team.query.get(i), j, ''] for (i, j) in teams]
-    place = 0
-    places = [[] for _ in range(len(teams))]
-    for team in teams:
-        if not places[place]:
-            places[place].append(team)
-        elif (team[0].indicator == places[place][0][0].indicator
-                and team[0].touches_scored == places[place][0][0].touches_scored
-                and team[1] == places[place][0][1]):
-            places[place].append(team)
-        else:
-            place += 1
-            places[place].append(team)
-    place = 1
-    for row in list(filter(lambda x: x, places)):
-        if len(row) == 1:
-            row[0][2] = str(place)
-            place += 1
-        else:
-            for team in row:
-                team[2] = str(place) + 'T'
-            place += len(row)
+    teams = [[standing.team, standing.win_percent, standing.place_string()]
+             for standing in event_standings(event)]
 
     return render_template(
         'pool-results-teams.html',
@@ -220,37 +278,36 @@ def pool_results(event_id):
 
 
 @app.route('/event/<int:event_id>/pools')
-@cache.cached(timeout=TIMEOUT)
+@read_only
+@cached_by_version
+@query_budget(8)
 def public_pools(event_id):
     event = Event.query.get_or_404(event_id)
-    pools = event.pools
-    results = {}
-    teams = {}
-    for pool in pools:
-        if pool.pool_letter == 'O':
-            teams[pool.poolNum] = pool.teams.order_by(Team.num_in_pool.asc())
-            results[pool.poolNum] = {}
-            for result in pool.results:
-                team = Team.query.filter_by(
-                    pool=pool, id=result.team.id).first()
-                opponent_team = Team.query.filter_by(
-                    id=result.opponent_team.id).first()
-                results[pool.poolNum][str(team.num_in_pool)+str(opponent_team.num_in_pool)] = result
+    pools = event.pools.all()
     return render_template(
         'pools.html',
         title='Pools',
         event=event,
         pools=pools,
-        results=results,
-        teams=teams)
+        matrices=pool_matrices(event))
+
+
+@app.route('/event/<int:event_id>/stream')
+def live_event(event_id):
+    Event.query.get_or_404(event_id)
+    stream = event_stream(
+        event_id, request.headers.get('Last-Event-ID', type=int))
+    return Response(stream, mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 
 @app.route('/event/<int:event_id>/pool-assignment')
-@cache.cached(timeout=TIMEOUT)
+@read_only
+@cached_by_version
 def pool_assignment(event_id):
     event = Event.query.get_or_404(event_id)
     public = True
-    if is_to_of_tournament(current_user, event.tournament):
+    if is_to_of_tournament(current_user, event.tournament_id):
         public = False
     pools = event.pools
     return render_template(
@@ -262,40 +319,72 @@ def pool_assignment(event_id):
 
 
 @app.route('/event/<int:event_id>/de')
-@cache.cached(timeout=TIMEOUT)
+@read_only
+@cached_by_version
+@query_budget(5)
 def public_de(event_id):
     event = Event.query.get_or_404(event_id)
-    if(event.tableau_json == None):
+    bracket = bracket_document(event)
+    if bracket is None:
         return "DEs have not been posted yet. Please check again later."
     return render_template(
         'de.html',
         title='DE',
         event=event,
-        directElims=json.loads(event.tableau_json))
+        bracket=bracket)
+
+
+@app.route('/event/<int:event_id>/de.json')
+@read_only
+@query_budget(3)
+def public_de_json(event_id):
+    event = Event.query.get_or_404(event_id)
+    bracket = bracket_document(event)
+    if bracket is None:
+        return Response('null', status=404, mimetype='application/json')
+    response = Response(bracket, mimetype='application/json')
+    response.set_etag('bracket-{}-{}'.format(event.id, event.version))
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+
+@app.route('/event/<int:event_id>/export.ndjson', defaults={'section': None, 'format': 'ndjson'})
+@app.route('/event/<int:event_id>/export/<section>.<any(csv, ndjson):format>')
+@read_only
+def export_results(event_id, section, format):
+    # streamed as it is read, so the response is never cached or buffered
+    event = Event.query.get_or_404(event_id)
+    if section is not None and section not in SECTIONS:
+        abort(404)
+    if format == 'csv':
+        body, mimetype = export_csv(event, section), 'text/csv'
+    else:
+        body = export_ndjson(event, SECTIONS if section is None else [section])
+        mimetype = 'application/x-ndjson'
+    filename = '{}-{}.{}'.format(secure_filename(event.name) or 'event', section or 'results',
+                                 format)
+    response = Response(stream_with_context(body), mimetype=mimetype)
+    response.headers['Content-Disposition'] = 'attachment; filename="{}"'.format(filename)
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 
 @app.route('/event/<int:event_id>/final')
-@cache.cached(timeout=TIMEOUT)
+@read_only
+@cached_by_version
+@query_budget(7)
 def public_final(event_id):
     event = Event.query.get_or_404(event_id)
     #teams = event.teams.filter_by(is_checked_in=True).order_by(Team.final_place.asc()).all()
-    teams = Team.query.filter(Team.event_id==event_id,Team.is_checked_in==True,Team.final_place.isnot(None)).order_by(Team.final_place.asc()).all()
+    teams = placed_teams(event)
     teams = [[team, i, ''] for (i, team) in enumerate(teams)]
-    print("DE Teams: ", teams)
-    if event.teams.count() > 12:
-        q = db.engine.execute(
-        """SELECT t.id, (t.victories*1.0 / (p.num_fencers - 1)) as winPercent
-        FROM team t JOIN pool p ON t.Pool = p.id
-        WHERE t.is_checked_in = 1 AND t.event= {}
-        ORDER BY winPercent DESC, t.indicator DESC, t.touches_scored DESC
-        """.format(event_id))
-        pool_teams = [[Team.query.get(id), j, ''] for (id, j) in q]
-        for team in pool_teams[12:]:
-            teams.append(team)
-        print("All teams: ", teams)
+    cut = event.de_cut_size(event.standings.count())
+    if event.teams.count() > cut:
+        for standing in event_standings(event, offset=cut):
+            teams.append([standing.team, standing.win_percent, ''])
         place = 0
         places = [[] for _ in range(len(teams))]
-        for team in teams[:12]:
+        for team in teams[:cut]:
             if not places[place]:
                 places[place].append(team)
             elif team[0].de_indicator == places[place][0][0].de_indicator:
@@ -303,8 +392,8 @@ def public_final(event_id):
             else:
                 place += 1
                 places[place].append(team)
-        place = 12
-        for team in teams[12:]:
+        place = cut
+        for team in teams[cut:]:
             if not places[place]:
                 places[place].append(team)
             elif (team[0].indicator == places[place][0][0].indicator
@@ -330,7 +419,7 @@ def public_final(event_id):
 @login_required
 def edit_tournament(tournament_id):
     tournament = Tournament.query.filter_by(id=tournament_id).first()
-    if not is_to_of_tournament(current_user, tournament):
+    if not is_to_of_tournament(current_user, tournament.id):
         flash('You do not have permission to access this tournament.')
         return redirect(url_for('index'))
     form = AddTOForm()
@@ -348,6 +437,7 @@ def edit_tournament(tournament_id):
         tournament.organizers.append(access)
         db.session.add(access)
         db.session.commit()
+        forget_user(user.id)
     events = tournament.events
     return render_template(
         'edit-tournament.html',
@@ -359,14 +449,14 @@ def edit_tournament(tournament_id):
 
 @app.route('/event/<int:event_id>/registration/edit', methods=['GET', 'POST'])
 @login_required
+@query_budget(14)
 def edit_registration(event_id):
     event = Event.query.get_or_404(event_id)
     tournament = event.tournament
-    if not is_to_of_tournament(current_user, tournament):
+    if not is_to_of_tournament(current_user, tournament.id):
         flash('You do not have permission to access this tournament.')
         return redirect(url_for('index'))
 
-    teams = event.teams.all()
     form = AddTeamForm()
     if form.validate_on_submit():
 
@@ -413,22 +503,73 @@ def edit_registration(event_id):
         event.num_fencers_checked_in = Event.num_fencers_checked_in + 1
         event.num_fencers += 1
         db.session.add_all([club, team, fencer_a, fencer_b])
-        db.session.commit()
+        event.touch()
+        try:
+            db.session.commit()
+        except IntegrityError:  # team names are unique in an event
+            db.session.rollback()
+            flash('Team {} is already registered.'.format(form.teamName.data))
+            return redirect(url_for('edit_registration', event_id=event_id))
         flash('Added team')
         return redirect(url_for('edit_registration', event_id=event_id))
+    teams = event.teams.options(db.joinedload(Team.club)).all()
+    fencers = defaultdict(list)  # every team's fencers from one query
+    for fencer in Fencer.query.join(Team, Fencer.team_id == Team.id)\
+            .filter(Team.event_id == event.id).order_by(Fencer.id.asc()):
+        fencers[fencer.team_id].append(fencer)
     return render_template(
         'edit-registration-teams.html',
         form=form,
+        import_form=RosterImportForm(),
         teams=teams,
+        fencers=fencers,
         event=event,
         allCheckedIn=(event.num_fencers_checked_in == event.num_fencers))
 
 
+@app.route('/event/<int:event_id>/registration/import', methods=['POST'])
+@login_required
+@query_budget(22)
+def import_registration(event_id):
+    event = Event.query.get_or_404(event_id)
+    if not is_to_of_tournament(current_user, event.tournament_id):
+        flash('You do not have permission to access this tournament.')
+        return redirect(url_for('index'))
+    if event.stage != Stage.REGISTRATION_OPEN.value:
+        flash('Teams can only be imported while registration is open.')
+        return redirect(url_for('edit_registration', event_id=event_id))
+    form = RosterImportForm()
+    if not form.validate_on_submit():
+        flash('Choose a CSV or JSON file to import.')
+        return redirect(url_for('edit_registration', event_id=event_id))
+    upload = form.roster.data
+    try:
+        teams = parse_roster(upload.stream, upload.filename or '')
+        try:
+            import_teams(event, teams)
+            db.session.commit()
+        except IntegrityError:  # team names are unique in an event
+            db.session.rollback()
+            names = {team['name'] for team in teams}
+            raise RosterError([(None, 'Team {} is already registered.'.format(name))
+                               for name, in db.session.query(Team.name)
+                               .filter(Team.event_id == event_id) if name in names])
+    except RosterError as e:
+        for line, message in e.errors[:10]:
+            flash('Line {}: {}'.format(line, message) if line else message)
+        if len(e.errors) > 10:
+            flash('... and {} more.'.format(len(e.errors) - 10))
+        flash('No teams were imported.')
+        return redirect(url_for('edit_registration', event_id=event_id))
+    flash('Imported {} teams'.format(len(teams)))
+    return redirect(url_for('edit_registration', event_id=event_id))
+
+
 @app.route('/event/<int:event_id>/edit-pools')
 @login_required
 def edit_pools(event_id):
     event = Event.query.get_or_404(event_id)
-    if not is_to_of_tournament(current_user, event.tournament):
+    if not is_to_of_tournament(current_user, event.tournament_id):
         flash('You do not have permission to access this tournament.')
         return redirect(url_for('index'))
     pools = event.pools
@@ -444,72 +585,30 @@ def edit_pools(event_id):
 @app.route(
     '/event/<int:event_id>/pool/<int:pool_id>/edit', methods=['GET', 'POST'])
 @login_required
+@query_budget(23)
 def edit_pool(event_id, pool_id):
     pool = Pool.query.filter_by(id=pool_id).first()
-    if not is_to_of_tournament(current_user, pool.event.tournament):
+    if not is_to_of_tournament(current_user, pool.event.tournament_id):
         flash('You do not have permission to access this tournament.')
         return redirect(url_for('index'))
     if request.method == "POST":
-        for key, value in request.form.items():
-            key = key.strip('result')
+        sheet = parse_pool_sheet(request.form)
+        scores = {}
+        for (i, j), value in sheet.items():
             score1 = Score(value)
-            score2 = Score(request.form['result'+str(key[1])+str(key[0])])
+            score2 = Score(request.form['result'+str(j)+str(i)])
             if not (score1 and score2 and is_valid_pair(score1, score2)):
                 flash('Invalid score.')
                 return redirect(
                     url_for('edit_pool', event_id=event_id, pool_id=pool_id))
-            fencer = Fencer.query.filter_by(
-                pool_id=pool_id, num_in_pool=key[0]).first()
-            opponent = Fencer.query.filter_by(
-                pool_id=pool_id, num_in_pool=key[1]).first()
-            result = Result(
-                pool_id=pool.id,
-                event_id=event_id,
-                fencer=fencer.id,
-                team=fencer.team,
-                fencer_score=score1.touches,
-                opponent=opponent.id,
-                opponent_team=opponent.team,
-                fencer_win=score1.is_winner())
-            fencer.victories = Fencer.victories + (1 if result.fencer_win else 0)
-            fencer.touches_scored = Fencer.touches_scored + result.fencer_score
-            fencer.indicator = Fencer.indicator + result.fencer_score
-            opponent.touches_recieved = Fencer.touches_recieved + result.fencer_score
-            opponent.indicator = Fencer.indicator - result.fencer_score
-            fencer_team_touches_scored = fencer.team.touches_scored + result.fencer_score
-            fencer.team.touches_scored = fencer_team_touches_scored
-            fencer_team_indicator = fencer.team.indicator + result.fencer_score
-            fencer.team.indicator = fencer_team_indicator
-            opponent_team_touches_recieved = opponent.team.touches_recieved + result.fencer_score
-            opponent.team.touches_recieved = opponent_team_touches_recieved
-            opponent_team_indicator = opponent.team.indicator - result.fencer_score
-            opponent.team.indicator = opponent_team_indicator
-            team_result = Result.query.filter_by(
-                pool_id=fencer.team.pool.id,
-                team=fencer.team,
-                opponent_team=opponent.team).first()
-            pool.results.append(result)
-            db.session.add(result)
-            if team_result is not None:
-                team_result.fencer_score = Result.fencer_score + result.fencer_score
-            else:
-                team_result = Result(
-                    pool_id=fencer.team.pool.id,
-                    team=fencer.team,
-                    opponent_team=opponent.team,
-                    fencer_score=result.fencer_score)
-                fencer.team.pool.results.append(team_result)
-                db.session.add(team_result)
-            individual_results = db.session.query(Result).filter(
-                Result.team_id == fencer.team.id,
-                Result.opponent_team_id == opponent.team.id,
-                Result.pool_id != fencer.team.pool.id,
-                Result.fencer_win == True).all()
-            if len(individual_results) >= 2 and not team_result.fencer_win:
-                team_result.fencer_win = True
-                fencer.team.victories = Team.victories + 1
-
+            scores[(i, j)] = score1
+        record_pool_results(pool, scores)
         pool.state = 1
+        pool.event.touch()
+        db.session.flush()
+        db.session.expire_all()
+        for matrix in pool_matrices(pool.event, pool.poolNum).values():
+            publish(event_id, 'pool', pool_payload(matrix))
         db.session.commit()
         return redirect(url_for('edit_pools', event_id=event_id))
     elif request.method == "GET":
@@ -530,11 +629,37 @@ def edit_pool_assignment(event_id):
     return render_template('edit-pool-assignment.html', event=event, pools=pools)
 
 
+@app.route('/event/<int:event_id>/optimize-pool-assignment')
+@login_required
+@query_budget(5)
+def optimize_pool_assignment(event_id):
+    event = Event.query.get_or_404(event_id)
+    if not is_to_of_tournament(current_user, event.tournament_id):
+        return jsonify(error='You do not have permission to access this tournament.'), 403
+    pools = event.pools.filter_by(pool_letter='O').order_by(Pool.poolNum.asc()).all()
+    if not pools:
+        return jsonify(error='Pools have not been created yet.'), 400
+    teams = db.session.query(Team.id, Team.club_id)\
+        .filter(Team.event_id == event.id, Team.is_checked_in == True)\
+        .order_by(Team.id.asc()).all()
+    assignment = optimize_pools(
+        teams,
+        [pool.num_fencers for pool in pools],
+        app.config['POOL_ASSIGNMENT_BUDGET'])
+    # same layout as the drag and drop page posts to submit_pool_assignment
+    return jsonify(
+        pools={str(i): team_ids for i, team_ids in enumerate(assignment.pools)},
+        conflicts=assignment.conflicts,
+        lower_bound=assignment.lower_bound,
+        imbalance=assignment.imbalance)
+
+
 @app.route('/event/<int:event_id>/submit-pools', methods=['GET'])
 @login_required
+@query_budget(11)
 def submit_pools(event_id):
     event = Event.query.get_or_404(event_id)
-    if not is_to_of_tournament(current_user, event.tournament):
+    if not is_to_of_tournament(current_user, event.tournament_id):
         flash('You do not have permission to access this tournament.')
         return redirect(url_for('index'))
     pools = event.pools
@@ -545,134 +670,72 @@ def submit_pools(event_id):
             if pool.state == 0 and pool.pool_letter != 'O':
                 all_pools_done = False
     if all_pools_done:
+        refresh_standings(event)
         event.advance_stage(Stage.POOL_RESULTS)
+        event.touch()
     db.session.commit()
     return redirect(url_for('pool_results', event_id=event.id))
 
 
 @app.route('/event/<int:event_id>/submit-pool-assignment', methods=['POST'])
 @login_required
+@query_budget(16)
 def submit_pool_assignment(event_id):
     event = Event.query.get_or_404(event_id)
-    if not is_to_of_tournament(current_user, event.tournament):
+    if not is_to_of_tournament(current_user, event.tournament_id):
         flash('You do not have permission to access this tournament.')
         return redirect(url_for('index'))
-    pools = event.pools
-    content = request.get_json(silent=True)
-    for _pool, teams in content.items():
-        for num_in_pool, _team in enumerate(teams):
-            team = Team.query.filter_by(name=_team, event=event).first()
-            team.pool.num_fencers = Pool.num_fencers - 1
-            team.pool.teams.remove(team)
-            team.num_in_pool = num_in_pool + 1
-            for fencer in team.fencers:
-                if fencer.team_position == 'D':
-                    continue
-                fencer.num_in_pool = num_in_pool + 1
-                fencer.pool.num_fencers = Pool.num_fencers - 1
-                fencer.pool.fencers.remove(fencer)
-
-                new_pool = Pool.query.filter_by(event_id=event_id, pool_letter=fencer.team_position, poolNum=int(_pool)+1).first()
-                new_pool.fencers.append(fencer)
-                new_pool.num_fencers = Pool.num_fencers + 1
-            pool = Pool.query.filter_by(event_id=event_id, poolNum=int(_pool)+1, pool_letter='O').first()
-            team.pool_id = pool.id
-            team.pool = pool
-            pool.teams.append(team)
-            pool.num_fencers = Pool.num_fencers + 1
+    try:
+        reassign_pools(event, request.get_json(silent=True) or {})
+    except (KeyError, ValueError):
+        db.session.rollback()
+        flash('The pool assignment refers to an unknown pool or team.')
+        return redirect(url_for('edit_pool_assignment', event_id=event_id))
+    refresh_standings(event)
     event.advance_stage(Stage.POOL_ASSIGNMENTS)
     event.advance_stage(Stage.POOLS)
+    event.touch()
     db.session.commit()
     return redirect(url_for('edit_pools', event_id=event_id))
 
 
 @app.route('/event/<int:event_id>/generate-bracket')
 @login_required
+@query_budget(13)
 def generate_bracket(event_id):
     event = Event.query.get_or_404(event_id)
-    if not is_to_of_tournament(current_user, event.tournament):
+    if not is_to_of_tournament(current_user, event.tournament_id):
         flash('You do not have permission to access this tournament.')
         return redirect(url_for('index'))
     if event.stage != 8:
         flash('DEs cannot be generated at this stage')
         return redirect(url_for('index'))
-    q = db.engine.execute(
-        """SELECT t.id, (t.victories*1.0 / (p.num_fencers - 1)) as winPercent
-        FROM team t JOIN pool p ON t.Pool = p.id
-        WHERE t.is_checked_in = 1 AND t.Event = {}
-        ORDER BY winPercent DESC, t.indicator DESC, t.touches_scored DESC LIMIT 12;
-        """.format(event_id))
-    teams = [Team.query.get(id) for (id, _) in q]
-    fencer_names = [(team.name + " (" + str(i+1) + ")") for i, team in enumerate(teams)]
-    bracket = generate_tournament(teams)
-    num_rounds = int(math.log(len(bracket)*2, 2))
-    j = num_rounds
-    for i in [2**i for i in range(num_rounds-1)]:
-        for _ in range(i):
-            de = DE(
-                state=4,
-                event_id=event.id,
-                round=j)
-            db.session.add(de)
-            event.des.append(de)
-        j -= 1
-    third = DE(
-        state=4,
-        is_third=True,
-        event_id=event.id,
-        round=int(math.log(len(bracket)*2, 2)))
-    db.session.add(third)
-    event.des.append(de)
-    for fencer1, fencer2 in bracket:
-        if fencer2 is None:
-            de = DE(team1_id=fencer1.id, state=3, round=1)
-            event.des.append(de)
-            des = de.event.des.filter_by(is_third=False)\
-                .order_by(DE.id.asc()).all()
-            next_de = des[int(((des.index(de) + 1) & ~(1 << 0))/2) - 1]
-            if (des.index(de) + 1) % 2 == 0:
-                next_de.team1 = de.team1
-            else:
-                next_de.team2 = de.team1
-            if next_de.team1 is not None and next_de.team2 is not None:
-                next_de.state = 0
-        else:
-            de = DE(
-                team1_id=(fencer1.id if fencer1 is not None else None),
-                team2_id=(fencer2.id if fencer2 is not None else None),
-                state=0, round=1)
-            event.des.append(de)
-        db.session.add(de)
-
-    tableau = {}
-    tableau['teams'] = generate_tournament(fencer_names)
-    tableau['results'] = [[] for _ in range(
-        int(math.log(len(tableau['teams'])*2, 2)))]
-    i = 1
-    for round in range(int(math.log(len(tableau['teams'])*2, 2))):
-        if round == 0:
-            tableau['results'][round] = [[] for _ in range(2)]
-            tableau['results'][round][1] = [None, None, 'third']
-        else:
-            tableau['results'][round] = [[] for _ in range(2 ** round)]
-        for match in range(2 ** round):
-            tableau['results'][round][match] = [None, None, 'match' + str(i)]
-            i += 1
-    tableau['results'] = tableau['results'][::-1]
-    event.tableau_json = json.dumps(tableau)
+    cut = event.de_cut_size(event.standings.count())
+    teams = [standing.team for standing in event_standings(event, limit=cut)]
+    create_bracket(event, teams)
     event.advance_stage(Stage.DES)
+    event.touch()
     db.session.commit()
     return redirect(url_for('edit_DE', event_id=event_id))
 
 
 @app.route('/de/<int:de_id>/submit', methods=['POST'])
 @login_required
+@query_budget(25)
 def submit_DE(de_id):
     de = DE.query.get(de_id)
     event = Event.query.get_or_404(de.event.id)
-    if not is_to_of_tournament(current_user, event.tournament):
+    if not is_to_of_tournament(current_user, event.tournament_id):
         flash('You do not have permission to access this tournament.')
         return redirect(url_for('index'))
+    if de.state not in (0, 1):  # fenced already, a bye, or still waiting on teams
+        flash('This bout cannot be submitted.')
+        return redirect(url_for('edit_DE', event_id=event.id))
+    if de.match_num is None:  # tableau generated before DEs were linked
+        link_bracket(
+            event,
+            event.des.filter_by(is_third=False).order_by(DE.id.asc()).all(),
+            event.des.filter_by(is_third=True).first())
     de.fencer1_score = int(request.form['fencer1'])
     de.fencer2_score = int(request.form['fencer2'])
     if de.fencer1_score == de.fencer2_score:
@@ -681,101 +744,32 @@ def submit_DE(de_id):
         de.fencer1_win = True if de.fencer1_score > de.fencer2_score else False
     de.state = 2
     db.session.commit()
-    tableau = json.loads(de.event.tableau_json)
-
-    des = de.event.des.filter_by(is_third=False).order_by(DE.id.asc()).all()
-
-    # not final or semi
-    if not de.is_third and des.index(de) not in [0, 1, 2]:
-        round = de.round - 1
-        match = tableau['results'][round].index(
-            [None, None, 'match' + str(des.index(de)+1)])
-        tableau['results'][round][match] = [de.fencer1_score, de.fencer2_score]
-        de.event.tableau_json = json.dumps(tableau)
-        next_de = des[int(((des.index(de) + 1) & ~(1 << 0))/2) - 1]
-        if (des.index(de) + 1) % 2 == 0:
-            if de.fencer1_win:
-                next_de.team1 = de.team1
-                de.team2.round_eliminated_in = de.round
-            else:
-                next_de.team1 = de.team2
-                de.team1.round_eliminated_in = de.round
-        else:
-            if de.fencer1_win:
-                next_de.team2 = de.team1
-                de.team2.round_eliminated_in = de.round
-            else:
-                next_de.team2 = de.team2
-                de.team1.round_eliminated_in = de.round
-        if next_de.team1 is not None and next_de.team2 is not None:
-            next_de.state = 0
-        # check if all DEs in round finished
-        num_eliminated = Team.query.filter_by(
-            round_eliminated_in=(round+1), event_id=de.event.id).count()
-        byes = DE.query.filter_by(
-            event_id=de.event.id, team2_id=None, state=3).count()
-        if ((round == 0
-                and num_eliminated == (int(len(tableau['teams'])/2**round) - byes))
-            or (round > 0
-                and num_eliminated == int(len(tableau['teams'])/2**round))):
-            q = db.engine.execute(
-                """SELECT d.id, abs(d.fencer1_score - d.fencer2_score) AS score
-                FROM de d
-                WHERE d.event_id = {} AND d.round = {}
-                AND d.team2_id IS NOT NULL
-                ORDER BY score DESC;""".format(de.event.id, round+1))
-            des_in_round = [[DE.query.get(id), j] for (id, j) in q]
-            if round == 0:
-                place1 = Team.query.filter_by(
-                    event_id=de.event.id, is_checked_in=True).count()
-            else:
-                place1 = int(len(tableau['teams'])/(2**round-1))
-            for i, val in enumerate(des_in_round):
-                loser_team = val[0].team2 if val[0].fencer1_win else val[0].team1
-                loser_team.final_place = place1 - i
-                loser_team.de_indicator = val[1]
-    elif not de.is_third and des.index(de) in [1, 2]:  # semifinal
-        third = event.des.filter_by(is_third=True).first()
-        if (des.index(de) + 1) % 2 == 0:
-            third.team1 = de.team2 if de.fencer1_win else de.team1
-        else:
-            third.team2 = de.team2 if de.fencer1_win else de.team1
-        if third.team1 is not None and third.team2 is not None:
-            third.state = 0
-        final = des[0]
-        if (des.index(de) + 1) % 2 == 0:
-            final.team1 = de.team1 if de.fencer1_win else de.team2
-        else:
-            final.team2 = de.team1 if de.fencer1_win else de.team2
-        if final.team1 is not None and final.team2 is not None:
-            final.state = 0
-        round = de.round - 1
-        match = tableau['results'][round].index(
-            [None, None, 'match' + str(des.index(de)+1)])
-        tableau['results'][round][match] = [de.fencer1_score, de.fencer2_score]
-        de.event.tableau_json = json.dumps(tableau)
-    elif de.is_third:  # third
-        round = int(math.log(len(tableau['teams']), 2))
-        match = tableau['results'][round].index([None, None, 'third'])
-        tableau['results'][round][match] = [de.fencer1_score, de.fencer2_score]
-        de.event.tableau_json = json.dumps(tableau)
-        de.team1.round_eliminated_in = de.round
-        de.team2.round_eliminated_in = de.round
-        de.team1.final_place = 3 if de.fencer1_win else 4
-        de.team2.final_place = 4 if de.fencer1_win else 3
-    elif des.index(de) == 0:  # final
-        round = int(math.log(len(tableau['teams']), 2))
-        match = tableau['results'][round].index([None, None, 'match1'])
-        tableau['results'][round][match] = [de.fencer1_score, de.fencer2_score]
-        de.event.tableau_json = json.dumps(tableau)
+
+    (winner, loser) = (de.team1, de.team2) if de.fencer1_win else (de.team2, de.team1)
+    if de.next_de is not None:
+        advance_team(de.next_de, de.next_slot, winner)
+    if de.loser_de is not None:  # semifinal
+        advance_team(de.loser_de, de.loser_slot, loser)
+    elif de.next_de is not None:
+        loser.round_eliminated_in = de.round
+        finish_bout(event, de)
+    else:  # final or third
         de.team1.round_eliminated_in = de.round
         de.team2.round_eliminated_in = de.round
-        de.team1.final_place = 1 if de.fencer1_win else 2
-        de.team2.final_place = 2 if de.fencer1_win else 1
+        place = 3 if de.is_third else 1
+        winner.final_place = place
+        loser.final_place = place + 1
     # check if all DEs finished
-    des_not_finished = de.event.des.filter_by(state=0).count()
+    des_not_finished = open_bouts(event)
     if des_not_finished == 0:
         de.event.advance_stage(Stage.EVENT_FINISHED)
+    round, match = match_position(de)
+    publish(event.id, 'de', {
+        'de': de.id,
+        'round': round,
+        'match': match,
+        'scores': [de.fencer1_score, de.fencer2_score]})
+    event.touch()
     db.session.commit()
     return redirect(url_for('edit_DE', event_id=de.event.id))
 
@@ -784,16 +778,17 @@ def submit_DE(de_id):
 @login_required
 def edit_DE(event_id):
     event = Event.query.get_or_404(event_id)
-    if not is_to_of_tournament(current_user, event.tournament):
+    if not is_to_of_tournament(current_user, event.tournament_id):
         flash('You do not have permission to access this tournament.')
         return redirect(url_for('index'))
-    if event.tableau_json == None:
+    bracket = bracket_document(event)
+    if bracket is None:
         return "DEs have not been posted yet."
     des = event.des.order_by(DE.round.asc())
     return render_template(
         'edit-de.html',
         event=event,
-        directElims=json.loads(event.tableau_json),
+        bracket=bracket,
         des=des)
 
 
@@ -802,7 +797,7 @@ def edit_DE(event_id):
 def check_in_team(event_id, team_id):
     event = Event.query.get_or_404(event_id)
     tournament = event.tournament
-    if not is_to_of_tournament(current_user, tournament):
+    if not is_to_of_tournament(current_user, tournament.id):
         flash('You do not have permission to access this tournament.')
         return redirect(url_for('index'))
     if event.stage >= 4:
@@ -811,6 +806,7 @@ def check_in_team(event_id, team_id):
     team = Team.query.get(team_id)
     team.is_checked_in = True
     event.num_fencers_checked_in = Event.num_fencers_checked_in + 1
+    event.touch()
     db.session.commit()
     return redirect(url_for('edit_registration', event_id=event_id))
 
@@ -820,7 +816,7 @@ def check_in_team(event_id, team_id):
 def make_team_absent(event_id, team_id):
     event = Event.query.get_or_404(event_id)
     tournament = event.tournament
-    if not is_to_of_tournament(current_user, tournament):
+    if not is_to_of_tournament(current_user, tournament.id):
         flash('You do not have permission to access this tournament.')
         return redirect(url_for('index'))
     if event.stage >= 4:
@@ -829,6 +825,7 @@ def make_team_absent(event_id, team_id):
     team = Team.query.get(team_id)
     team.is_checked_in = False
     event.num_fencers_checked_in = Event.num_fencers_checked_in - 1
+    event.touch()
     db.session.commit()
     return redirect(url_for('edit_registration', event_id=event_id))
 
@@ -839,7 +836,7 @@ def make_team_absent(event_id, team_id):
 def edit_team(event_id, team_id):
     event = Event.query.get_or_404(event_id)
     tournament = event.tournament
-    if not is_to_of_tournament(current_user, tournament):
+    if not is_to_of_tournament(current_user, tournament.id):
         flash('You do not have permission to access this tournament.')
         return redirect(url_for('index'))
     team = Team.query.get(team_id)
@@ -882,8 +879,14 @@ def edit_team(event_id, team_id):
             else:
                 club.teams.append(team)
             team.club = club
+        event.touch()
+        try:
+            db.session.commit()
+        except IntegrityError:  # team names are unique in an event
+            db.session.rollback()
+            flash('Team {} is already registered.'.format(form.teamName.data))
+            return redirect(url_for('edit_team', event_id=event_id, team_id=team_id))
         flash('Edited team')
-        db.session.commit()
         return redirect(url_for('edit_registration', event_id=event_id))
     elif request.method == 'GET':
         form.submit.label.text = "Edit Team"
@@ -900,7 +903,7 @@ def edit_team(event_id, team_id):
 @login_required
 def delete_team(event_id, team_id):
     event = Event.query.get_or_404(event_id)
-    if not is_to_of_tournament(current_user, event.tournament):
+    if not is_to_of_tournament(current_user, event.tournament_id):
         flash('You do not have permission to access this tournament.')
         return redirect(url_for('index'))
     if event.stage >= 3:
@@ -913,6 +916,7 @@ def delete_team(event_id, team_id):
     db.session.delete(team)
     for fencer in team.fencers:
         db.session.delete(fencer)
+    event.touch()
     db.session.commit()
     return redirect(url_for('edit_registration', event_id=event_id))
 
@@ -922,74 +926,53 @@ def delete_team(event_id, team_id):
 def open_registration(event_id):
     event = Event.query.get_or_404(event_id)
     tournament = event.tournament
-    if not is_to_of_tournament(current_user, tournament):
+    if not is_to_of_tournament(current_user, tournament.id):
         flash('You do not have permission to access this tournament.')
         return redirect(url_for('index'))
     event.advance_stage(Stage.REGISTRATION_OPEN)
+    event.touch()
     db.session.commit()
     return redirect(url_for('edit_registration', event_id=event_id))
 
 
 @app.route('/event/<int:event_id>/close-registration')
 @login_required
+@query_budget(7)
 def close_registration(event_id):
     event = Event.query.get_or_404(event_id)
     tournament = event.tournament
-    if not is_to_of_tournament(current_user, tournament):
+    if not is_to_of_tournament(current_user, tournament.id):
         flash('You do not have permission to access this tournament.')
         return redirect(url_for('index'))
     event.advance_stage(Stage.REGISTRATION_CLOSED)
+    event.touch()
     db.session.commit()
     return redirect(url_for('edit_registration', event_id=event_id))
 
 
 @app.route('/event/<int:event_id>/create-pools', methods=['GET', 'POST'])
 @login_required
+@query_budget(14)
 def create_pools(event_id):
     event = Event.query.get_or_404(event_id)
-    if not is_to_of_tournament(current_user, event.tournament):
+    if not is_to_of_tournament(current_user, event.tournament_id):
         flash('You do not have permission to access this tournament.')
         return redirect(url_for('index'))
+    if not event.is_stage(Stage.REGISTRATION_CLOSED):
+        flash('Pools cannot be created at this stage')
+        return redirect(url_for('edit_registration', event_id=event_id))
     form = CreatePoolForm()
-    teams = event.teams.filter_by(is_checked_in=True)\
-        .order_by(Team.club_id.asc(), func.random())
     form.num_fencers.data = event.num_fencers_checked_in
     if form.validate_on_submit():
-
-        def add_pools(event, pool_num, num_fencers):
-            letters = ['A', 'B', 'C', 'O']
-            tmp_pools = []
-            for letter in letters:
-                pool = Pool(event_id=event.id, num_fencers=num_fencers,
-                            poolNum=pool_num, pool_letter=letter)
-                tmp_pools.append(pool)
-                db.session.add(pool)
-            return tmp_pools
-
-        pools = []
-        pool_num = 1
-        for _ in range(0, form.numPools1.data):
-            pools.append(add_pools(event, pool_num, form.numFencers1.data))
-            pool_num += 1
-        for _ in range(0, form.numPools2.data):
-            pools.append(add_pools(event, pool_num, form.numFencers2.data))
-            pool_num += 1
-
-        pools = quicksort(pools)
-
-        pool_num = [0 for _ in pools]
-        for i, team in enumerate(teams):
-            pools[i % len(pools)][3].teams.append(team)
-            team.num_in_pool = pool_num[i % len(pools)] + 1
-            team.pool = pools[i % len(pools)][3]
-            fencers = team.fencers.order_by(Fencer.team_position.asc())
-            for j in range(3):
-                pools[i % len(pools)][j].fencers.append(fencers[j])
-                fencers[j].num_in_pool = pool_num[i % len(pools)] + 1
-                fencers[j].pool = pools[i % len(pools)][j]
-            pool_num[i % len(pools)] += 1
-
+        assignment = create_event_pools(
+            event,
+            [form.numFencers1.data] * form.numPools1.data
+            + [form.numFencers2.data] * form.numPools2.data)
+        if assignment.conflicts:
+            flash('{} pairs of teams from the same club share a pool.'.format(
+                assignment.conflicts))
         event.advance_stage(Stage.INITIAL_SEEDING)
+        event.touch()
         db.session.commit()
         return redirect(url_for('initial_seeding', event_id=event_id))
     return render_template(
@@ -1027,6 +1010,7 @@ def reset_password(token):
     if form.validate_on_submit():
         user.set_password(form.password.data)
         db.session.commit()
+        forget_user(user.id)
         flash('Your password has been reset.')
         return redirect(url_for('login'))
     return render_template('reset-password.html', form=form)
@@ -1052,6 +1036,7 @@ def preregister(token):
             event.teams.append(team)
             club.teams.append(team)
             event.num_fencers += 1
+            event.touch()
             for i, name in enumerate(name_list):
                 if name is None or name == '':
                     name = ['', '']
@@ -1115,7 +1100,12 @@ def preregister(token):
                 form.Saber_B.fencer_b.data,
                 form.Saber_B.fencer_c.data,
                 form.Saber_B.fencer_d.data])
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:  # team names are unique in an event
+            db.session.rollback()
+            flash('Your teams are already registered.')
+            return redirect(url_for('index'))
         flash('You have preregistered.')
         return redirect(url_for('index'))
     return render_template('preregistration.html', title='Preregistration', form=form, tournament=tournament, club=club)
@@ -1124,7 +1114,7 @@ def preregister(token):
 @app.route('/tournament/<int:tournament_id>/send-prereg-email', methods=['GET', 'POST'])
 def send_prereg(tournament_id):
     tournament = Tournament.query.get_or_404(tournament_id)
-    if not is_to_of_tournament(current_user, tournament):
+    if not is_to_of_tournament(current_user, tournament.id):
         flash('You do not have permission to access this tournament.')  # TODO: add this to similar checks
         return redirect(url_for('index'))
     form = EmailListForm()
@@ -1132,26 +1122,41 @@ def send_prereg(tournament_id):
         try:
             data = json.load(form.email_json.data.stream)
         except JSONDecodeError as e:
-            flask('Invalid JSON')
+            flash('Invalid JSON')
             return redirect(url_for('send_prereg', tournament_id=tournament.id))
         for club_name, email in data.items():
             if club_name not in app.config['UNIVERSITIES'] or not re.match(r"^[a-zA-Z0-9.!#$%&'*+/=?^_`{|}~-]+@[a-zA-Z0-9](?:[a-zA-Z0-9-]{0,61}[a-zA-Z0-9])?(?:\.[a-zA-Z0-9](?:[a-zA-Z0-9-]{0,61}[a-zA-Z0-9])?)*$", email):
                 flash('Invalid JSON')
                 return redirect(url_for('send_prereg', tournament_id=tournament.id))
-            club = Club.query.filter_by(name=club_name).first()
-            if club is None:
-                club = Club(name=club_name)
-                db.session.add(club)
-                db.session.commit()
+        clubs = {club.name: club for club in
+                 Club.query.filter(Club.name.in_(list(data)))}
+        for club_name in data:
+            if club_name not in clubs:
+                clubs[club_name] = Club(name=club_name)
+                db.session.add(clubs[club_name])
+        db.session.commit()
+        for club_name, email in data.items():
+            club = clubs[club_name]
             token = jwt.encode(
                 {'club': club.id, 'tournament': tournament.id, 'exp': time() + 604800},
                 app.config['SECRET_KEY'], algorithm='HS256').decode('utf-8')
             send_prereg_email(email, token, club, tournament)
-        flash('Preregistration emails have been sent.')
+        flash('{} preregistration emails have been queued.'.format(len(data)))
         return redirect(url_for('edit_tournament', tournament_id=tournament.id))
     return render_template('send-prereg-email.html', title='Preregistration', form=form, tournament=tournament)
 
 
+@app.route('/tournament/<int:tournament_id>/email-status')
+@login_required
+def prereg_email_status(tournament_id):
+    tournament = Tournament.query.get_or_404(tournament_id)
+    if not is_to_of_tournament(current_user, tournament.id):
+        flash('You do not have permission to access this tournament.')
+        return redirect(url_for('index'))
+    return jsonify([delivery.as_dict() for delivery in
+                    mail_queue.status(prereg_tag(tournament))])
+
+
 @app.route('/event/<int:event_id>/de-sheet/<int:team1_id>/<int:team2_id>')
 def de_sheet(event_id, team1_id, team2_id):
     team1 = Team.query.get_or_404(team1_id)
@@ -1163,14 +1168,70 @@ def de_sheet(event_id, team1_id, team2_id):
 @login_required
 def delete_pool(event_id, pool_id):
     event = Event.query.get_or_404(event_id)
-    if not is_to_of_tournament(current_user, event.tournament):
+    if not is_to_of_tournament(current_user, event.tournament_id):
         flash(' You do not have permission to access this tournament.')
         return redirect(url_for('index'))
     db.session.query(Result).filter(Result.pool_id == pool_id).delete(False)
     pool = Pool.query.get_or_404(pool_id)
     pool.state = 0
+    event.touch()
     db.session.commit()
     return redirect(url_for('edit_pools', event_id=event_id))
 
 
-#flask_profiler.init_app(app)
+
+def can_profile(user):
+    # admins only: stacks show every route's code paths, and sampling costs
+    # every worker CPU while it runs
+    return user.email in app.config['ADMINS']
+
+
+@app.route('/profiler')
+@login_required
+def profiler_status():
+    if not can_profile(current_user):
+        flash('You do not have permission to use the profiler.')
+        return redirect(url_for('index'))
+    return jsonify(sampler.status())
+
+
+@app.route('/profiler/start')
+@login_required
+def start_profiler():
+    if not can_profile(current_user):
+        flash('You do not have permission to use the profiler.')
+        return redirect(url_for('index'))
+    seconds = request.args.get('seconds', 60, type=int)
+    rate = request.args.get('rate', app.config['PROFILER_RATE'], type=int)
+    sampler.start(min(max(seconds, 1), app.config['PROFILER_MAX_SECONDS']),
+                  min(max(rate, 1), app.config['PROFILER_MAX_RATE']))
+    return jsonify(sampler.status())
+
+
+@app.route('/profiler/stop')
+@login_required
+def stop_profiler():
+    if not can_profile(current_user):
+        flash('You do not have permission to use the profiler.')
+        return redirect(url_for('index'))
+    sampler.stop()
+    return jsonify(sampler.status())
+
+
+@app.route('/profiler/stacks.txt')
+@login_required
+def profiler_stacks():
+    # collapsed stacks, e.g. flamegraph.pl stacks.txt > stacks.svg
+    if not can_profile(current_user):
+        flash('You do not have permission to use the profiler.')
+        return redirect(url_for('index'))
+    return Response(sampler.collapsed(request.args.get('endpoint')), mimetype='text/plain')
+
+
+@app.route('/metrics')
+def metrics():
+    # Prometheus scrape target; set METRICS_TOKEN to require a bearer token
+    token = app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != 'Bearer ' + token:
+        return Response(status=401)
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
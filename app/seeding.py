@@ -0,0 +1,31 @@
+MAX_BRACKET_SIZE = 1024
+
+
+def bracket_size(num_teams):  # smallest power of 2 holding every team
+    size = 2
+    while size < num_teams:
+        size *= 2
+    return size
+
+
+def seed_order(size):
+    """Seeds in bracket order for a bracket of `size` (a power of 2) slots.
+
+    Doubling the bracket puts each seed s next to its opponent 2m + 1 - s,
+    so seeds 1 and 2 can only meet in the final. Every pass writes a flat
+    list twice as long as the last, which is O(size) work in total.
+    """
+    if size > MAX_BRACKET_SIZE:
+        raise ValueError('Brackets are limited to {} teams.'.format(MAX_BRACKET_SIZE))
+    order = [1]
+    while len(order) < size:
+        opponent = 2 * len(order) + 1
+        order = [seed for s in order for seed in (s, opponent - s)]
+    return order
+
+
+def seed_bracket(teams):
+    # first round pairs for teams in seed order, byes go to the top seeds
+    order = seed_order(bracket_size(len(teams)))
+    slots = [teams[seed - 1] if seed <= len(teams) else None for seed in order]
+    return [[slots[i], slots[i + 1]] for i in range(0, len(slots), 2)]
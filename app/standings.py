@@ -0,0 +1,98 @@
+from sqlalchemy import bindparam
+
+from app import db
+from app.models import Team, Pool, Standing
+from app.queries import bakery
+
+_event_standings = bakery(lambda session: session.query(Standing).filter(
+    Standing.event_id == bindparam('event_id')))
+_ranked_standings = bakery(lambda session: session.query(Standing)
+                           .options(db.joinedload(Standing.team))
+                           .filter(Standing.event_id == bindparam('event_id'))
+                           .order_by(Standing.place.asc(), Standing.team_id.asc()))
+_team_statistics = bakery(lambda session: session.query(
+    Team.id, Team.victories, Team.indicator, Team.touches_scored, Pool.num_fencers)
+    .join(Pool, Team.pool_id == Pool.id)
+    .filter(Team.event_id == bindparam('event_id'), Team.is_checked_in == True))
+
+
+def win_percent(victories, pool_size):
+    return victories * 1.0 / (pool_size - 1) if pool_size > 1 else 0.0
+
+
+def _sort_key(row):
+    return (-row['win_percent'], -row['indicator'], -row['touches_scored'],
+            row['team_id'])
+
+
+def update_standings(event_id, values, replace=False):
+    """Merge new pool statistics into the event's standings and re-rank.
+
+    `values` maps team_id to a dict of win_percent, indicator and
+    touches_scored. Only rows whose statistics or place changed are written.
+    With `replace`, rows for teams missing from `values` are removed.
+    """
+    existing = {standing.team_id: standing for standing in
+                _event_standings(db.session()).params(event_id=event_id)}
+    if replace:
+        stale = [standing.id for standing in existing.values()
+                 if standing.team_id not in values]
+        if stale:
+            Standing.query.filter(Standing.id.in_(stale))\
+                .delete(synchronize_session=False)
+        existing = {k: v for k, v in existing.items() if k in values}
+
+    rows = {}
+    for team_id, standing in existing.items():
+        rows[team_id] = dict(
+            id=standing.id, event_id=event_id, team_id=team_id,
+            win_percent=standing.win_percent, indicator=standing.indicator,
+            touches_scored=standing.touches_scored, place=standing.place,
+            is_tied=standing.is_tied)
+    old = {team_id: dict(row) for team_id, row in rows.items()}
+    for team_id, stats in values.items():
+        rows.setdefault(team_id, dict(id=None, event_id=event_id,
+                                      team_id=team_id)).update(stats)
+
+    ranked = sorted(rows.values(), key=_sort_key)
+    for i, row in enumerate(ranked):
+        if i and _sort_key(row)[:3] == _sort_key(ranked[i-1])[:3]:
+            row['place'] = ranked[i-1]['place']
+        else:
+            row['place'] = i + 1
+    tied = {}
+    for row in ranked:
+        tied[row['place']] = tied.get(row['place'], 0) + 1
+    for row in ranked:
+        row['is_tied'] = tied[row['place']] > 1
+
+    db.session.bulk_update_mappings(
+        Standing, [row for row in ranked
+                   if row['id'] is not None and row != old[row['team_id']]])
+    inserts = []
+    for row in ranked:
+        if row['id'] is None:
+            row = dict(row)
+            del row['id']
+            inserts.append(row)
+    db.session.bulk_insert_mappings(Standing, inserts)
+
+
+def refresh_standings(event):
+    # full rebuild from the team aggregates, used when pool membership changes
+    values = {}
+    for id, victories, indicator, touches_scored, pool_size in \
+            _team_statistics(db.session()).params(event_id=event.id):
+        values[id] = dict(win_percent=win_percent(victories, pool_size),
+                          indicator=indicator, touches_scored=touches_scored)
+    update_standings(event.id, values, replace=True)
+
+
+def event_standings(event, limit=None, offset=None):
+    # top-k by place, served from ix_standing_event_place
+    q = _ranked_standings
+    if offset is not None:
+        q = q.with_criteria(lambda q: q.offset(bindparam('offset')))
+    if limit is not None:
+        q = q.with_criteria(lambda q: q.limit(bindparam('limit')))
+    return q(db.session()).params(event_id=event.id, offset=offset, limit=limit).all()
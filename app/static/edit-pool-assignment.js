@@ -51,6 +51,25 @@ function randomizeAllPools() {
   });
 }
 
+function optimizePools(url) {
+  $('#pool-score').text('Optimizing...');
+  $.getJSON(url, function(data) {
+    var $items = {};
+    $('ul.connectedSortable li').each(function() {
+      $items[$(this).data('id')] = $(this);
+    });
+    $('ul.connectedSortable').each(function(i) {
+      var $ul = $(this);
+      $.each(data.pools[i] || [], function(_, id) {
+        $ul.append($items[id]);
+      });
+    });
+    $('#pool-score').text(data.conflicts + ' same-club pairings (at least ' + data.lower_bound + ' unavoidable)');
+  }).fail(function() {
+    $('#pool-score').text('Could not optimize the pools.');
+  });
+}
+
 $(function() {
     var form = document.forms[0];
 
@@ -62,7 +81,7 @@ $(function() {
     var data = {};
     $('ul.connectedSortable').each(function(i, v) {
         var $this = $(this);
-        data[i] = $this.find('.ui-state-default').map(function() {return $(this).text()}).toArray();
+        data[i] = $this.find('.ui-state-default').map(function() {return $(this).data('id')}).toArray();
     });
 
     // construct an HTTP request
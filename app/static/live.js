@@ -0,0 +1,57 @@
+// Follows an event's live update stream, calling handlers[kind](data)
+// for each update. Browsers reconnect on their own and the server replays
+// what was missed using the Last-Event-ID header.
+function followEvent(url, handlers) {
+  if (!window.EventSource) {
+    return;
+  }
+  var source = new EventSource(url);
+  Object.keys(handlers).forEach(function(kind) {
+    source.addEventListener(kind, function(e) {
+      handlers[kind](JSON.parse(e.data));
+    });
+  });
+  return source;
+}
+
+function updateStage(data) {
+  var elements = document.getElementsByClassName('event-stage');
+  for (var i = 0; i < elements.length; i++) {
+    elements[i].textContent = data.name;
+  }
+}
+
+function updatePool(data) {
+  var table = document.getElementById('pool-' + data.pool);
+  if (!table) {
+    return;
+  }
+  data.teams.forEach(function(team) {
+    var row = table.querySelector('tr[data-num="' + team.num + '"]');
+    if (!row) {
+      return;
+    }
+    team.results.forEach(function(result, i) {
+      var cell = row.querySelector('td[data-column="' + (i + 1) + '"]');
+      if (!cell) {
+        return;
+      }
+      var victory = result !== null && result[0];
+      cell.className = 'match ' + (victory ? 'victory' : 'defeat');
+      cell.textContent = (victory ? 'V' : 'D') + (result !== null ? result[1] : '');
+    });
+    var stats = {
+      victories: team.victories,
+      win_percent: team.win_percent.toFixed(2),
+      touches_scored: team.touches_scored,
+      touches_recieved: team.touches_recieved,
+      indicator: (team.indicator > 0 ? '+' : '') + team.indicator
+    };
+    Object.keys(stats).forEach(function(stat) {
+      var cell = row.querySelector('td[data-stat="' + stat + '"]');
+      if (cell) {
+        cell.textContent = stats[stat];
+      }
+    });
+  });
+}
@@ -0,0 +1,240 @@
+"""Read throughput on SQLite while organizers are writing.
+
+    python benchmarks/concurrency.py [--readers 8] [--writers 2] [--seconds 10]
+        [--teams 30] [--pool-size 6] [--busy-timeout MS]
+
+Sets up one event in its pools stage in a temp file database. Writer
+processes then keep re-submitting pool sheets through edit_pool, as
+organizers at the scoring table do, while reader processes fetch public
+pages that go to the database (the pool bouts export, the pools page and
+the standings API) as spectators do. Each is its own process, like
+gunicorn workers sharing the database file. This runs twice:
+
+    rollback    the old setup: rollback journal, synchronous=FULL, the
+                driver's 5 second busy timeout, reads on the main engine
+    wal         the defaults: WAL, synchronous=NORMAL, SQLITE_BUSY_TIMEOUT
+                and public pages on the read-only engine
+
+Connections are pooled in both runs.
+
+Reported per run are reads and writes per second, read latency
+percentiles and errors such as "database is locked". Lock waits only show
+in latency once the processes have CPUs of their own; --busy-timeout 1
+turns every wait into a counted error instead.
+"""
+import argparse
+from collections import Counter
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from lifecycle import Recorder, fencer_name, percentile, pool_layout, team_name
+
+MODES = {
+    'rollback': dict(SQLITE_JOURNAL_MODE='DELETE', SQLITE_SYNCHRONOUS='FULL',
+                     SQLITE_BUSY_TIMEOUT='5000', READ_ONLY_DATABASE_URL=''),
+    'wal': dict(),
+}
+READ_PAGES = ['/event/{event}/export/pool_bouts.csv', '/event/{event}/pools',
+              '/api/v1/events/{event}/standings']
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--teams', type=int, default=30)
+    parser.add_argument('--pool-size', type=int, default=6)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--busy-timeout', type=int,
+                        help='SQLITE_BUSY_TIMEOUT in ms for both runs; with 1 every lock '
+                             'conflict is counted as an error instead of a wait')
+    # set when the script runs itself for one mode, or one worker of a run
+    parser.add_argument('--mode', choices=sorted(MODES), help=argparse.SUPPRESS)
+    parser.add_argument('--role', choices=['read', 'write'], help=argparse.SUPPRESS)
+    parser.add_argument('--start', type=float, help=argparse.SUPPRESS)
+    parser.add_argument('--sheets', help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def pool_sheet(rng, size):
+    sheet = {}
+    for i in range(1, size + 1):
+        for j in range(i + 1, size + 1):
+            loser = 'D{}'.format(rng.randint(0, 4))
+            if rng.random() < 0.5:
+                sheet['result{}{}'.format(i, j)], sheet['result{}{}'.format(j, i)] = 'V5', loser
+            else:
+                sheet['result{}{}'.format(i, j)], sheet['result{}{}'.format(j, i)] = loser, 'V5'
+    return sheet
+
+
+def set_up(app, args, rng):
+    # one event of args.teams teams, pools assigned and open for scoring
+    from app.models import Pool
+    run = Recorder(app, app.test_client())
+    run('POST', '/register', data=dict(username='bench', email='bench@example.com',
+                                       password='bench', password2='bench'))
+    run('POST', '/login', data=dict(username='bench', password='bench'))
+    run('POST', '/create-tournament', data=dict(name='Benchmark Open'))
+    run('POST', '/tournament/1/create-event', data=dict(
+        name='Event', weapon='foil', date='2030-01-01', de_cut=16, de_cut_type='count'))
+    clubs = app.config['UNIVERSITIES'][:6]
+    for i in range(args.teams):
+        run('POST', '/event/1/registration/edit', data=dict(
+            teamName=team_name(i), fencer_a=fencer_name(i, 'Alpha'),
+            fencer_b=fencer_name(i, 'Bravo'), fencer_c=fencer_name(i, 'Charlie'),
+            fencer_d='', club=rng.choice(clubs)))
+    run('GET', '/event/1/close-registration')
+    run('POST', '/event/1/create-pools', data=pool_layout(args.teams, args.pool_size))
+    layout = json.loads(run('GET', '/event/1/optimize-pool-assignment').data)['pools']
+    run('POST', '/event/1/submit-pool-assignment', data=json.dumps(layout),
+        content_type='application/json')
+    sheets = [(pool.id, pool.num_fencers) for pool in Pool.query.filter(
+        Pool.event_id == 1, Pool.pool_letter != 'O').order_by(Pool.id)]
+    for pool_id, size in sheets:  # every pool scored once, so reads have rows
+        run('POST', '/event/1/pool/{}/edit'.format(pool_id), data=pool_sheet(rng, size))
+    return sheets
+
+
+class Load():
+
+    def __init__(self, app):
+        self.app = app
+        self.latencies = []
+        self.errors = Counter()
+
+    def request(self, client, method, path, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = client.open(path, method=method, **kwargs)
+            error = None if response.status_code < 400 else 'HTTP {}'.format(
+                response.status_code)
+            response.close()
+        except Exception as e:  # TESTING propagates errors from the view
+            error = '{}: {}'.format(type(e).__name__, str(e).split('\n')[0][:80])
+        if error is None:
+            self.latencies.append(time.perf_counter() - start)
+        else:
+            self.errors[error] += 1
+
+    def read(self, rng, until):
+        client = self.app.test_client()
+        while time.time() < until:
+            self.request(client, 'GET', rng.choice(READ_PAGES).format(event=1))
+
+    def write(self, rng, until, sheets):
+        client = self.app.test_client()
+        client.post('/login', data=dict(username='bench', password='bench'))
+        while time.time() < until:
+            pool_id, size = rng.choice(sheets)
+            self.request(client, 'POST', '/event/1/pool/{}/edit'.format(pool_id),
+                         data=pool_sheet(rng, size))
+
+
+def load_app():
+    from app import app
+
+    app.config['TESTING'] = True
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.logger.setLevel(logging.WARNING)
+    return app
+
+
+def run_worker(args):
+    # one reader or writer process, like one gunicorn worker
+    app = load_app()
+    rng = random.Random(args.seed)
+    load = Load(app)
+    time.sleep(max(0, args.start - time.time()))
+    if args.role == 'read':
+        load.read(rng, args.start + args.seconds)
+    else:
+        load.write(rng, args.start + args.seconds, json.loads(args.sheets))
+    return dict(latencies=load.latencies, errors=dict(load.errors))
+
+
+def run_mode(args):
+    # sets up the database, then runs the readers and writers against it
+    db_file = tempfile.mktemp(suffix='.db')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + db_file
+    app = load_app()
+    from app import db, cache
+
+    with app.app_context():
+        cache.clear()
+        db.create_all()
+        journal_mode = db.session.execute('PRAGMA journal_mode').scalar()
+        sheets = set_up(app, args, random.Random(args.seed))
+        db.session.remove()
+
+    start = time.time() + 5  # time for every worker to import the app
+    command = [sys.executable, os.path.abspath(__file__), '--mode', args.mode,
+               '--seconds', str(args.seconds), '--start', repr(start)]
+    workers = [('read', subprocess.Popen(
+        command + ['--role', 'read', '--seed', str(i)], stdout=subprocess.PIPE))
+        for i in range(args.readers)]
+    workers += [('write', subprocess.Popen(
+        command + ['--role', 'write', '--seed', str(1000 + i), '--sheets', json.dumps(sheets)],
+        stdout=subprocess.PIPE)) for i in range(args.writers)]
+    latencies = {'read': [], 'write': []}
+    errors = Counter()
+    for role, worker in workers:
+        output, _ = worker.communicate()
+        result = json.loads(output.decode().strip().splitlines()[-1])
+        latencies[role] += result['latencies']
+        for error, count in result['errors'].items():
+            errors['{} {}'.format(role, error)] += count
+    for suffix in ('', '-wal', '-shm', '-journal'):
+        if os.path.exists(db_file + suffix):
+            os.unlink(db_file + suffix)
+
+    reads, writes = latencies['read'], latencies['write']
+    return dict(
+        mode=args.mode, journal_mode=journal_mode,
+        reads_per_second=round(len(reads) / args.seconds, 1),
+        writes_per_second=round(len(writes) / args.seconds, 1),
+        read_ms={name: round(percentile(reads, p) * 1000, 2) if reads else None
+                 for name, p in (('p50', 50), ('p95', 95), ('p99', 99), ('max', 100))},
+        write_ms_p50=round(percentile(writes, 50) * 1000, 2) if writes else None,
+        errors=dict(errors))
+
+
+def main():
+    args = parse_args()
+    if args.role:
+        print(json.dumps(run_worker(args)))
+        return
+    if args.mode:
+        print(json.dumps(run_mode(args)))
+        return
+
+    print('{:<10} {:>8} {:>8} {:>9} {:>9} {:>9} {:>9} {:>10}  {}'.format(
+        'mode', 'reads/s', 'writes/s', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms',
+        'write p50', 'errors'))
+    for mode, env in sorted(MODES.items()):
+        env = dict(os.environ, **env)
+        env.pop('DATABASE_URL', None)
+        if args.busy_timeout is not None:
+            env['SQLITE_BUSY_TIMEOUT'] = str(args.busy_timeout)
+        output = subprocess.check_output(
+            [sys.executable, os.path.abspath(__file__), '--mode', mode] + sys.argv[1:],
+            env=env)
+        result = json.loads(output.decode().strip().splitlines()[-1])
+        read_ms = result['read_ms']
+        print('{:<10} {!s:>8} {!s:>8} {!s:>9} {!s:>9} {!s:>9} {!s:>9} {!s:>10}  {}'.format(
+            mode, result['reads_per_second'], result['writes_per_second'], read_ms['p50'],
+            read_ms['p95'], read_ms['p99'], read_ms['max'], result['write_ms_p50'],
+            ', '.join('{} x{}'.format(error, count)
+                      for error, count in sorted(result['errors'].items())) or '-'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,264 @@
+"""Full-lifecycle benchmark: runs synthetic tournaments through the app.
+
+    python benchmarks/lifecycle.py [--teams 32] [--clubs 6] [--pool-size 6]
+        [--de-cut 16] [--percent] [--events 1] [--page-views 5] [--memory]
+        [--output report.json] [--baseline old-report.json]
+
+Every request goes through the Flask test client against a fresh SQLite
+database (a temp file, or in memory with --memory): registration,
+create_pools, optimize and submit_pool_assignment, edit_pool for every
+pool, generate_bracket, submit_DE for every bout, then the public pages
+with nobody signed in. Latency percentiles and SQL statement counts are
+reported per route and written as JSON; with --baseline the report is
+compared to one from an earlier version.
+
+The app's cache directory is cleared first, since cached brackets and
+users are keyed by ids the fresh database reuses.
+"""
+import argparse
+import datetime
+import json
+import logging
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+PUBLIC_PAGES = [
+    '/', '/explore', '/tournament/{tournament}', '/event/{event}/registration',
+    '/event/{event}/initial-seeding', '/event/{event}/pool-assignment',
+    '/event/{event}/pools', '/event/{event}/pool-results', '/event/{event}/de',
+    '/event/{event}/de.json', '/event/{event}/final']
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--teams', type=int, default=32)
+    parser.add_argument('--clubs', type=int, default=6)
+    parser.add_argument('--pool-size', type=int, default=6)
+    parser.add_argument('--de-cut', type=int, default=16)
+    parser.add_argument('--percent', action='store_true',
+                        help='read --de-cut as a percentage of the teams')
+    parser.add_argument('--events', type=int, default=1)
+    parser.add_argument('--page-views', type=int, default=5,
+                        help='times every public page is fetched per event')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--memory', action='store_true', help='use an in-memory database')
+    parser.add_argument('--output', default='lifecycle-report.json')
+    parser.add_argument('--baseline', help='earlier report to compare against')
+    return parser.parse_args()
+
+
+def pool_layout(num_teams, pool_size):
+    # pools of pool_size and pool_size - 1 seating every team
+    num_pools = -(-num_teams // pool_size)
+    small = num_pools * pool_size - num_teams
+    if small > num_pools:
+        raise SystemExit('{} teams cannot be split into pools of {} and {}'.format(
+            num_teams, pool_size, pool_size - 1))
+    if small == num_pools:
+        return dict(numPools1=small, numFencers1=pool_size - 1, numPools2=0, numFencers2=0,
+                    num_fencers=num_teams)
+    return dict(numPools1=num_pools - small, numFencers1=pool_size, numPools2=small,
+                numFencers2=pool_size - 1 if small else 0, num_fencers=num_teams)
+
+
+def percentile(values, p):  # nearest rank
+    values = sorted(values)
+    return values[max(0, int(math.ceil(p / 100.0 * len(values))) - 1)]
+
+
+class Recorder():
+
+    def __init__(self, app, client):
+        self.app = app
+        self.client = client
+        self.adapter = app.url_map.bind('localhost')
+        self.queries = 0
+        self.samples = {}
+
+    def count(self, *args, **kwargs):
+        self.queries += 1
+
+    def __call__(self, method, path, **kwargs):
+        endpoint = self.adapter.match(path.split('?')[0], method=method)[0]
+        self.queries = 0
+        start = time.perf_counter()
+        response = self.client.open(path, method=method, **kwargs)
+        elapsed = time.perf_counter() - start
+        # forms redirect once accepted, a rejected one renders again
+        expected = (302,) if method == 'POST' else (200, 302, 304)
+        if response.status_code not in expected:
+            raise SystemExit('{} {} returned {}'.format(method, path, response.status_code))
+        latencies, queries = self.samples.setdefault(endpoint, ([], []))
+        latencies.append(elapsed)
+        queries.append(self.queries)
+        return response
+
+    def report(self):
+        routes = {}
+        for endpoint, (latencies, queries) in sorted(self.samples.items()):
+            routes[endpoint] = dict(
+                requests=len(latencies),
+                latency_ms={name: round(percentile(latencies, p) * 1000, 3)
+                            for name, p in (('p50', 50), ('p90', 90), ('p99', 99),
+                                            ('max', 100))},
+                queries=dict(mean=round(sum(queries) / float(len(queries)), 2),
+                             max=max(queries), total=sum(queries)))
+        return routes
+
+
+def team_name(i):
+    return 'Team {}'.format(i + 1)
+
+
+def fencer_name(i, position):  # names may only hold letters
+    letters = ''
+    while True:
+        i, r = divmod(i, 26)
+        letters = chr(ord('a') + r) + letters
+        if not i:
+            return '{} {}'.format(position, letters.title())
+
+
+def run_event(run, args, rng, clubs, tournament_id):
+    date = datetime.date.today() + datetime.timedelta(days=7)
+    run('POST', '/tournament/{}/create-event'.format(tournament_id), data=dict(
+        name='Event', weapon=rng.choice(['foil', 'epee', 'saber']), date=date.isoformat(),
+        de_cut=args.de_cut, de_cut_type='percent' if args.percent else 'count'))
+    from app.models import DE, Event, Pool
+    event_id = Event.query.order_by(Event.id.desc()).first().id
+    event_url = '/event/{}'.format(event_id)
+
+    for i in range(args.teams):
+        run('POST', event_url + '/registration/edit', data=dict(
+            teamName=team_name(i), fencer_a=fencer_name(i, 'Alpha'),
+            fencer_b=fencer_name(i, 'Bravo'),
+            fencer_c=fencer_name(i, 'Charlie') if rng.random() < 0.8 else '',
+            fencer_d=fencer_name(i, 'Delta') if rng.random() < 0.3 else '',
+            club=rng.choice(clubs)))
+    run('GET', event_url + '/close-registration')
+    run('POST', event_url + '/create-pools', data=pool_layout(args.teams, args.pool_size))
+
+    layout = json.loads(run('GET', event_url + '/optimize-pool-assignment').data)['pools']
+    run('POST', event_url + '/submit-pool-assignment', data=json.dumps(layout),
+        content_type='application/json')
+
+    sheets = [(pool.id, pool.num_fencers) for pool in Pool.query.filter(
+        Pool.event_id == event_id, Pool.pool_letter != 'O').order_by(Pool.id)]
+    for pool_id, size in sheets:
+        sheet = {}
+        for i in range(1, size + 1):
+            for j in range(i + 1, size + 1):
+                touches = rng.randint(0, 4)
+                if rng.random() < 0.5:
+                    sheet['result{}{}'.format(i, j)] = 'V5'
+                    sheet['result{}{}'.format(j, i)] = 'D{}'.format(touches)
+                else:
+                    sheet['result{}{}'.format(i, j)] = 'D{}'.format(touches)
+                    sheet['result{}{}'.format(j, i)] = 'V5'
+        run('POST', '{}/pool/{}/edit'.format(event_url, pool_id), data=sheet)
+    run('GET', event_url + '/submit-pools')
+    run('GET', event_url + '/generate-bracket')
+
+    while True:
+        de = DE.query.filter(DE.event_id == event_id, DE.state == 0)\
+            .order_by(DE.round.asc(), DE.id.asc()).first()
+        if de is None:
+            break
+        score1, score2 = rng.sample(range(46), 2)
+        run('POST', '/de/{}/submit'.format(de.id), data=dict(fencer1=score1, fencer2=score2))
+    if Event.query.get(event_id).stage != 10:
+        raise SystemExit('event {} did not finish'.format(event_id))
+    return event_id
+
+
+def compare(report, baseline):
+    print('\n{:<28} {:>10} {:>10} {:>8} {:>9} {:>9}'.format(
+        'compared to baseline', 'p50 ms', 'was', 'ratio', 'queries', 'was'))
+    for endpoint, route in sorted(report['routes'].items()):
+        old = baseline['routes'].get(endpoint)
+        if old is None:
+            continue
+        new_p50, old_p50 = route['latency_ms']['p50'], old['latency_ms']['p50']
+        print('{:<28} {:>10.2f} {:>10.2f} {:>7.2f}x {:>9} {:>9}'.format(
+            endpoint, new_p50, old_p50, new_p50 / old_p50 if old_p50 else 0,
+            route['queries']['max'], old['queries']['max']))
+
+
+def main():
+    args = parse_args()
+    db_file = None
+    if args.memory:
+        os.environ['DATABASE_URL'] = 'sqlite://'
+    else:
+        db_file = tempfile.mktemp(suffix='.db')
+        os.environ['DATABASE_URL'] = 'sqlite:///' + db_file
+
+    from sqlalchemy import event as sa_event
+    from sqlalchemy.engine import Engine
+    from app import app, db, cache
+
+    app.config['TESTING'] = True
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.logger.setLevel(logging.WARNING)  # one line per request otherwise
+    rng = random.Random(args.seed)
+    clubs = app.config['UNIVERSITIES'][:max(1, args.clubs)]
+    started = time.perf_counter()
+    with app.app_context():
+        cache.clear()
+        db.create_all()
+        client = app.test_client()
+        run = Recorder(app, client)
+        sa_event.listen(Engine, 'before_cursor_execute', run.count)
+
+        run('POST', '/register', data=dict(username='bench', email='bench@example.com',
+                                           password='bench', password2='bench'))
+        run('POST', '/login', data=dict(username='bench', password='bench'))
+        run('POST', '/create-tournament', data=dict(name='Benchmark Open'))
+        events = [run_event(run, args, rng, clubs, 1) for _ in range(args.events)]
+        run('GET', '/logout')
+        for _ in range(args.page_views):
+            for event_id in events:
+                for page in PUBLIC_PAGES:
+                    run('GET', page.format(tournament=1, event=event_id))
+        db.session.remove()
+    if db_file is not None:
+        os.unlink(db_file)
+
+    try:
+        revision = subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+    report = dict(
+        revision=revision,
+        config={k: v for k, v in vars(args).items() if k not in ('output', 'baseline')},
+        seconds=round(time.perf_counter() - started, 3),
+        routes=run.report())
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+    print('{:<28} {:>8} {:>9} {:>9} {:>9} {:>9} {:>8}'.format(
+        'route', 'requests', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms', 'queries'))
+    for endpoint, route in sorted(report['routes'].items()):
+        latency = route['latency_ms']
+        print('{:<28} {:>8} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f} {:>8}'.format(
+            endpoint, route['requests'], latency['p50'], latency['p90'], latency['p99'],
+            latency['max'], route['queries']['max']))
+    print('{} events of {} teams in {:.1f}s, report written to {}'.format(
+        args.events, args.teams, report['seconds'], args.output))
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+"""Mail delivery against a local SMTP stand-in: thread per message vs the queue.
+
+    python benchmarks/mail_delivery.py [--messages 200] [--handshake-ms 50]
+        [--fail-every 0] [--drop-every 0]
+
+The stand-in accepts every message, after an optional delay on connect
+(the handshake), and can answer 451 to every Nth message or drop the
+connection after every Nth message to exercise retries. Reported are the
+wall time until every message is delivered, SMTP connections opened,
+peak thread count and the final status of every queued message.
+"""
+import argparse
+from collections import Counter
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+class StandIn(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 256
+
+    def __init__(self, handshake, fail_every, drop_every):
+        socketserver.ThreadingTCPServer.__init__(self, ('127.0.0.1', 0), SMTPHandler)
+        self.handshake = handshake
+        self.fail_every = fail_every
+        self.drop_every = drop_every
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.messages = 0  # accepted
+        self.attempts = 0
+
+    def reset(self):
+        self.connections = self.messages = self.attempts = 0
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+
+    def reply(self, line):
+        self.wfile.write((line + '\r\n').encode())
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+        time.sleep(server.handshake)
+        self.reply('220 stand-in ESMTP')
+        received = 0
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode().strip().upper()
+            if command.startswith(('EHLO', 'HELO')):
+                self.reply('250 stand-in')
+            elif command == 'DATA':
+                self.reply('354 end with .')
+                while self.rfile.readline() not in (b'.\r\n', b''):
+                    pass
+                with server.lock:
+                    server.attempts += 1
+                    fail = server.fail_every and server.attempts % server.fail_every == 0
+                    if not fail:
+                        server.messages += 1
+                received += 1
+                self.reply('451 try again later' if fail else '250 queued')
+                if server.drop_every and received % server.drop_every == 0:
+                    self.connection.shutdown(socket.SHUT_RDWR)
+                    return
+            elif command == 'QUIT':
+                self.reply('221 bye')
+                return
+            else:  # MAIL, RCPT, RSET, NOOP
+                self.reply('250 ok')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--handshake-ms', type=float, default=50)
+    parser.add_argument('--fail-every', type=int, default=0)
+    parser.add_argument('--drop-every', type=int, default=0)
+    args = parser.parse_args()
+
+    server = StandIn(args.handshake_ms / 1000.0, args.fail_every, args.drop_every)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ['MAIL_SERVER'] = '127.0.0.1'
+    os.environ['MAIL_PORT'] = str(server.server_address[1])
+    os.environ.setdefault('MAIL_RETRY_DELAY', '0.05')
+
+    from flask_mail import Message
+    from app import app, mail
+    from app.email import mail_queue
+
+    def message(i):
+        msg = Message('Message {}'.format(i), sender=app.config['ADMINS'][0],
+                      recipients=['club{}@example.com'.format(i)])
+        msg.body = 'Preregistration for club {}'.format(i)
+        return msg
+
+    def thread_per_message():  # what send_email used to do
+        def send(msg):
+            with app.app_context():
+                try:
+                    mail.send(msg)
+                except Exception:
+                    pass
+        threads = [threading.Thread(target=send, args=(message(i),))
+                   for i in range(args.messages)]
+        for thread in threads:
+            thread.start()
+        peak = threading.active_count()
+        for thread in threads:
+            thread.join()
+        return peak, None
+
+    def queued():
+        deliveries = [mail_queue.put(message(i)) for i in range(args.messages)]
+        peak = threading.active_count()
+        mail_queue.join()
+        return peak, Counter(delivery.status for delivery in deliveries)
+
+    print('{:<20} {:>9} {:>12} {:>10} {:>12}  {}'.format(
+        'sender', 'seconds', 'connections', 'delivered', 'peak threads', 'statuses'))
+    for name, run in (('thread per message', thread_per_message), ('mail queue', queued)):
+        server.reset()
+        start = time.perf_counter()
+        peak, statuses = run()
+        print('{:<20} {:>9.2f} {:>12} {:>10} {:>12}  {}'.format(
+            name, time.perf_counter() - start, server.connections, server.messages, peak,
+            dict(statuses) if statuses else ''))
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+"""EXPLAIN QUERY PLAN and timings of the hot statements, with and without
+the composite indexes.
+
+    python benchmarks/query_plans.py [num_events] [repeat]
+
+A throwaway SQLite database is filled with synthetic events, then every
+statement is explained and timed once with the composite indexes dropped
+(before) and once with them in place (after).
+"""
+import os
+import random
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+DB_FILE = tempfile.mktemp(suffix='.db')
+os.environ['DATABASE_URL'] = 'sqlite:///' + DB_FILE
+
+from sqlalchemy import bindparam  # noqa: E402
+
+from app import app, db  # noqa: E402
+from app.models import AccessTable, DE, DERound, Event, Fencer, Pool, Result, Team  # noqa: E402
+
+INDEXES = [
+    'ix_access_table_user_tournament', 'ix_team_event_checked_in', 'ix_team_pool_num',
+    'ix_pool_event_num_letter', 'ix_de_event_round_state', 'ix_de_round_event_round',
+    'ix_result_pool_teams', 'ix_result_teams', 'ix_fencer_pool_num',
+    'ix_fencer_team_position']
+
+TEAMS, POOL_SIZE = 40, 5
+
+
+def populate(num_events, rng):
+    session = db.session
+    session.bulk_insert_mappings(Event, [dict(id=e, name='Event {}'.format(e), stage=9)
+                                         for e in range(1, num_events + 1)])
+    teams, fencers, pools, results, des, rounds, access = [], [], [], [], [], [], []
+    for e in range(1, num_events + 1):
+        access.append(dict(user_id=e % 50 + 1, tournament_id=e))
+        for p in range(TEAMS // POOL_SIZE):
+            pool_id = len(pools) + 1
+            pools.append(dict(id=pool_id, event_id=e, poolNum=p + 1, pool_letter='O',
+                              num_fencers=POOL_SIZE))
+            members = []
+            for n in range(1, POOL_SIZE + 1):
+                team_id = len(teams) + 1
+                members.append(team_id)
+                teams.append(dict(id=team_id, event_id=e, pool_id=pool_id, num_in_pool=n,
+                                  is_checked_in=rng.random() < 0.95))
+                for position in 'ABC':
+                    fencers.append(dict(event_id=e, team_id=team_id, pool_id=pool_id,
+                                        team_position=position, num_in_pool=n))
+            for a in members:
+                for b in members:
+                    if a != b:
+                        results.append(dict(event_id=e, pool_id=pool_id, team_id=a,
+                                            opponent_team_id=b, fencer_win=a < b))
+        for p in range(1, 64):
+            des.append(dict(event_id=e, match_num=p, round=6 - (p.bit_length() - 1),
+                            state=rng.choice([0, 2, 4])))
+        for r in range(1, 7):
+            rounds.append(dict(event_id=e, round=r, bouts=2 ** (6 - r), finished=0))
+    for model, rows in ((Pool, pools), (Team, teams), (Fencer, fencers),
+                        (Result, results), (DE, des), (DERound, rounds),
+                        (AccessTable, access)):
+        session.bulk_insert_mappings(model, rows)
+    session.commit()
+
+
+def statements(num_events):
+    event_id = num_events // 2
+    pool_id = event_id * TEAMS // POOL_SIZE
+    team_id = event_id * TEAMS
+    session = db.session
+    return [
+        ('pool sheet fencers', session.query(Fencer).filter(
+            Fencer.pool_id == bindparam('pool_id')).order_by(Fencer.num_in_pool),
+         dict(pool_id=pool_id)),
+        ('pool seats', session.query(Team).filter(
+            Team.pool_id == bindparam('pool_id')).order_by(Team.num_in_pool),
+         dict(pool_id=pool_id)),
+        ('team pool results', session.query(Result).filter(
+            Result.pool_id == bindparam('pool_id'), Result.team_id == bindparam('team_id'),
+            Result.opponent_team_id == bindparam('opponent_team_id')),
+         dict(pool_id=pool_id, team_id=team_id, opponent_team_id=team_id - 1)),
+        ('team bout wins', session.query(Result).filter(
+            Result.team_id == bindparam('team_id'),
+            Result.opponent_team_id == bindparam('opponent_team_id')),
+         dict(team_id=team_id, opponent_team_id=team_id - 1)),
+        ('checked in teams', session.query(db.func.count(Team.id)).filter(
+            Team.event_id == bindparam('event_id'), Team.is_checked_in == True),
+         dict(event_id=event_id)),
+        ('team fencer by position', session.query(Fencer).filter(
+            Fencer.team_id == bindparam('team_id'),
+            Fencer.team_position == bindparam('position')),
+         dict(team_id=team_id, position='A')),
+        ('pool by letter', session.query(Pool.id).filter(
+            Pool.event_id == bindparam('event_id'), Pool.poolNum == bindparam('num'),
+            Pool.pool_letter == bindparam('letter')),
+         dict(event_id=event_id, num=3, letter='O')),
+        ('open bouts', session.query(db.func.count(DE.id)).filter(
+            DE.event_id == bindparam('event_id'), DE.state == 0),
+         dict(event_id=event_id)),
+        ('round losers', session.query(DE).filter(
+            DE.event_id == bindparam('event_id'), DE.round == bindparam('round'),
+            DE.team2_id != None),
+         dict(event_id=event_id, round=2)),
+        ('round progress', session.query(DERound.finished, DERound.bouts).filter(
+            DERound.event_id == bindparam('event_id'), DERound.round == bindparam('round')),
+         dict(event_id=event_id, round=2)),
+        ('tournament access', session.query(AccessTable.tournament_id).filter(
+            AccessTable.user_id == bindparam('user_id')),
+         dict(user_id=7)),
+    ]
+
+
+def prepare(connection, query, params):
+    compiled = query.statement.compile(dialect=connection.dialect)
+    values = compiled.construct_params(params)
+    return str(compiled), [values[name] for name in compiled.positiontup]
+
+
+def measure(connection, queries, repeat):
+    report = {}
+    for name, query, params in queries:
+        sql, args = prepare(connection, query, params)
+        plan = [row[-1] for row in connection.execute('EXPLAIN QUERY PLAN ' + sql, args)]
+        run = lambda: connection.execute(sql, args).fetchall()
+        report[name] = (plan, min(timeit.repeat(run, number=100, repeat=repeat)) / 100)
+    return report
+
+
+def main():
+    num_events = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    with app.app_context():
+        db.create_all()
+        populate(num_events, random.Random(0))
+        indexes = [index for table in db.metadata.tables.values()
+                   for index in table.indexes if index.name in INDEXES]
+        queries = statements(num_events)
+
+        for index in indexes:
+            index.drop(bind=db.engine)
+        with db.engine.connect() as connection:
+            before = measure(connection, queries, repeat)
+        for index in indexes:
+            index.create(bind=db.engine)
+        with db.engine.connect() as connection:
+            connection.execute('ANALYZE')
+            after = measure(connection, queries, repeat)
+    os.unlink(DB_FILE)
+
+    for name, _, _ in queries:
+        (old_plan, old), (new_plan, new) = before[name], after[name]
+        print('{} ({} events): {:.1f}us -> {:.1f}us, {:.1f}x'.format(
+            name, num_events, old * 1e6, new * 1e6, old / new))
+        print('  before: ' + '; '.join(old_plan))
+        print('  after:  ' + '; '.join(new_plan))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""Micro-benchmark of DE seeding against the nested-list generator it replaced.
+
+    python benchmarks/seeding.py [repeat]
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from app.seeding import seed_bracket  # noqa: E402
+
+
+# the previous app.utils implementation, kept here for comparison
+def nextPow2(v):
+    v -= 1
+    v |= v >> 1
+    v |= v >> 2
+    v |= v >> 4
+    v |= v >> 8
+    v |= v >> 16
+    v += 1
+    return v
+
+
+def tournament_round(no_of_teams, matchlist):
+    new_matches = []
+    for team_or_match in matchlist:
+        if type(team_or_match) == type([]):
+            new_matches += [tournament_round(no_of_teams, team_or_match)]
+        else:
+            new_matches += [[team_or_match, no_of_teams + 1 - team_or_match]]
+    return new_matches
+
+
+def flatten_list(matches):
+    teamlist = []
+    for team_or_match in matches:
+        if type(team_or_match) == type([]):
+            teamlist += flatten_list(team_or_match)
+        else:
+            teamlist += [team_or_match]
+    return teamlist
+
+
+def generate_tournament(fencers):
+    fencers = [fencer for fencer in fencers]
+    num = nextPow2(len(fencers))
+    teams = 1
+    result = [1]
+    while teams != num:
+        teams *= 2
+        result = tournament_round(teams, result)
+    result = flatten_list(result)
+    for _ in range(num - len(fencers)):
+        fencers.append(None)
+    for i, j in enumerate(result):
+        result[i] = fencers[j-1]
+    return [list(i) for i in zip(*[iter(result)]*2)]
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    print('{:>6} {:>14} {:>14} {:>8}'.format('teams', 'nested (us)', 'seeding (us)', 'speedup'))
+    for num_teams in (12, 24, 64, 100, 256, 500, 1024):
+        teams = ['team {}'.format(i) for i in range(num_teams)]
+        assert seed_bracket(teams) == generate_tournament(teams)
+        number = max(1, 20000 // num_teams)
+        old = min(timeit.repeat(lambda: generate_tournament(teams),
+                                number=number, repeat=repeat)) / number
+        new = min(timeit.repeat(lambda: seed_bracket(teams),
+                                number=number, repeat=repeat)) / number
+        print('{:>6} {:>14.1f} {:>14.1f} {:>7.1f}x'.format(
+            num_teams, old * 1e6, new * 1e6, old / new))
+
+
+if __name__ == '__main__':
+    main()
@@ -9,4 +9,4 @@ while true; do
 	sleep 5
 done
 flask db upgrade
-exec gunicorn -b :5000 --access-logfile - --error-logfile - fencingtournamenttool:app
+exec gunicorn -b :5000 -k gevent --worker-connections 1000 --access-logfile - --error-logfile - fencingtournamenttool:app
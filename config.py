@@ -9,12 +9,39 @@ class Config(object):
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
             'sqlite:///' + os.path.join(basedir, 'app.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # public pages read through a second engine on this URI, which refuses
+    # writes on SQLite; set READ_ONLY_DATABASE_URL empty to read through
+    # the main engine
+    SQLALCHEMY_READ_ONLY_URI = os.environ.get('READ_ONLY_DATABASE_URL',
+                                              SQLALCHEMY_DATABASE_URI)
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE') or 'WAL'
+    SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT') or 10000)  # ms
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS') or 'NORMAL'
+    SQLITE_CACHE_SIZE = int(os.environ.get('SQLITE_CACHE_SIZE') or -16000)  # KiB when negative
     MAIL_SERVER = os.environ.get('MAIL_SERVER')
     MAIL_PORT = int(os.environ.get('MAIL_PORT') or 25)
     MAIL_USE_TLS = os.environ.get('MAIL_USE_TLS') is not None
     MAIL_USERNAME = os.environ.get('MAIL_USERNAME')
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
     ADMINS = ['fencingtournamenttool@gmail.com']
+    MAIL_WORKERS = int(os.environ.get('MAIL_WORKERS') or 2)
+    MAIL_QUEUE_SIZE = int(os.environ.get('MAIL_QUEUE_SIZE') or 500)
+    MAIL_BATCH_SIZE = int(os.environ.get('MAIL_BATCH_SIZE') or 50)  # messages per SMTP connection
+    MAIL_RETRIES = int(os.environ.get('MAIL_RETRIES') or 3)
+    MAIL_RETRY_DELAY = float(os.environ.get('MAIL_RETRY_DELAY') or 2)  # seconds, doubled per retry
+    MAIL_ENQUEUE_TIMEOUT = float(os.environ.get('MAIL_ENQUEUE_TIMEOUT') or 5)
+    MAIL_STATUS_HISTORY = int(os.environ.get('MAIL_STATUS_HISTORY') or 1000)
+    LIVE_POLL_INTERVAL = float(os.environ.get('LIVE_POLL_INTERVAL') or 1)
+    LIVE_RETENTION = int(os.environ.get('LIVE_RETENTION') or 3600)  # seconds updates are replayable
+    AUTH_CACHE_TIMEOUT = int(os.environ.get('AUTH_CACHE_TIMEOUT') or 60)
+    POOL_ASSIGNMENT_BUDGET = float(os.environ.get('POOL_ASSIGNMENT_BUDGET') or 0.5)
+    QUERY_BUDGET_STRICT = os.environ.get('QUERY_BUDGET_STRICT') is not None
+    PROFILER_RATE = int(os.environ.get('PROFILER_RATE') or 100)  # samples per second
+    PROFILER_MAX_RATE = int(os.environ.get('PROFILER_MAX_RATE') or 200)
+    PROFILER_MAX_SECONDS = int(os.environ.get('PROFILER_MAX_SECONDS') or 600)
+    PROFILER_MAX_STACKS = int(os.environ.get('PROFILER_MAX_STACKS') or 20000)
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    TOURNAMENTS_PER_PAGE = int(os.environ.get('TOURNAMENTS_PER_PAGE') or 20)
     UNIVERSITIES = [
         'Baylor',
         'Rice',
@@ -0,0 +1,55 @@
+import atexit
+import logging
+import os
+import tempfile
+import unittest
+
+# the app reads its database from the environment when it is imported
+db_file = tempfile.mktemp(suffix='.db')
+os.environ['DATABASE_URL'] = 'sqlite:///' + db_file
+
+from app import app, db, cache
+from app.models import AccessTable, Event, Team, Tournament, User
+
+
+@atexit.register
+def remove_database():
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(db_file + suffix):
+            os.unlink(db_file + suffix)
+
+
+class AppTestCase(unittest.TestCase):
+    # a fresh database with one tournament, its TO signed in to self.client
+
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.logger.setLevel(logging.WARNING)  # one line per request otherwise
+        self.context = app.app_context()
+        self.context.push()
+        cache.clear()
+        db.create_all()
+        user = User(username='to', email='to@example.com')
+        user.set_password('to')
+        self.tournament = Tournament(name='Test Open')
+        db.session.add_all([user, self.tournament])
+        db.session.add(AccessTable(user=user, tournament=self.tournament, main_to=True))
+        db.session.commit()
+        self.client = app.test_client()
+        self.client.post('/login', data=dict(username='to', password='to'))
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def create_event(self, num_teams, stage):
+        event = Event(name='Event', weapon='foil', tournament=self.tournament,
+                      stage=stage.value, num_fencers=num_teams,
+                      num_fencers_checked_in=num_teams)
+        db.session.add(event)
+        for i in range(num_teams):
+            db.session.add(Team(name='Team {}'.format(i + 1), event=event, is_checked_in=True))
+        db.session.commit()
+        return event
@@ -0,0 +1,52 @@
+import random
+import unittest
+
+from base import AppTestCase
+from app import db
+from app.bracket import create_bracket
+from app.models import DE, Stage, Team
+
+
+class Bracket(AppTestCase):
+
+    def run_bracket(self, num_teams):
+        # fences every bout of a num_teams bracket, returns its teams best first
+        event = self.create_event(num_teams, Stage.DES)
+        create_bracket(event, event.teams.order_by(Team.id.asc()).all())
+        db.session.commit()
+        rng = random.Random(0)
+        while True:
+            de = DE.query.filter(DE.event_id == event.id, DE.state == 0)\
+                .order_by(DE.round.asc(), DE.id.asc()).first()
+            if de is None:
+                break
+            score1, score2 = rng.sample(range(16), 2)
+            response = self.client.post('/de/{}/submit'.format(de.id),
+                                        data=dict(fencer1=score1, fencer2=score2))
+            self.assertEqual(response.status_code, 302)
+            db.session.expire_all()
+        self.assertTrue(event.is_stage(Stage.EVENT_FINISHED))
+        return event.teams.order_by(Team.final_place.asc()).all()
+
+    def test_places_in_32_team_bracket(self):
+        teams = self.run_bracket(32)
+        self.assertEqual([team.final_place for team in teams], list(range(1, 33)))
+        for better, worse in zip(teams, teams[1:]):
+            self.assertGreaterEqual(better.round_eliminated_in, worse.round_eliminated_in)
+        quarterfinal_losers = [team.final_place for team in teams
+                               if team.round_eliminated_in == 3]
+        self.assertEqual(quarterfinal_losers, [5, 6, 7, 8])
+
+    def test_places_with_byes(self):
+        teams = self.run_bracket(12)
+        self.assertEqual([team.final_place for team in teams], list(range(1, 13)))
+
+    def test_places_with_bye_into_final(self):
+        # seed 1 goes straight to the final, and must not also be in the
+        # bout for third
+        teams = self.run_bracket(3)
+        self.assertEqual([team.final_place for team in teams], [1, 2, 3])
+
+
+if __name__ == "__main__":
+    unittest.main()
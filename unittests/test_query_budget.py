@@ -0,0 +1,90 @@
+import json
+import unittest
+
+from base import AppTestCase
+from app import app, db
+from app.instrumentation import count_queries
+from app.models import Pool, Stage, Tournament
+
+
+def letters(i):  # fencer names may only hold letters
+    return chr(ord('a') + i // 26) + chr(ord('a') + i % 26)
+
+
+class QueryBudget(AppTestCase):
+
+    def assertWithinBudget(self, endpoint, stats):
+        self.assertLessEqual(stats.count, app.view_functions[endpoint].query_budget)
+
+    def register_teams(self, num_teams):
+        # a new event with num_teams teams registered
+        event = self.create_event(0, Stage.REGISTRATION_OPEN)
+        url = '/event/{}'.format(event.id)
+        clubs = app.config['UNIVERSITIES']
+        for i in range(num_teams):
+            self.client.post(url + '/registration/edit', data=dict(
+                teamName='Team {}'.format(i + 1), fencer_a='Alpha ' + letters(i),
+                fencer_b='Bravo ' + letters(i), fencer_c='Charlie ' + letters(i),
+                fencer_d='', club=clubs[i % 3]))
+        return event
+
+    def seat_pool(self, num_teams):
+        # registers num_teams teams and seats them all in one pool
+        event = self.register_teams(num_teams)
+        url = '/event/{}'.format(event.id)
+        self.client.get(url + '/close-registration')
+        self.client.post(url + '/create-pools', data=dict(
+            numPools1=1, numFencers1=num_teams, numPools2=0, numFencers2=0,
+            num_fencers=num_teams))
+        layout = json.loads(self.client.get(url + '/optimize-pool-assignment').data)
+        self.client.post(url + '/submit-pool-assignment', data=json.dumps(layout['pools']),
+                         content_type='application/json')
+        pool = Pool.query.filter(Pool.event_id == event.id, Pool.pool_letter != 'O').first()
+        self.assertIsNotNone(pool)
+        return '{}/pool/{}/edit'.format(url, pool.id)
+
+    def submit_sheet(self, pool_url, size):
+        sheet = {}
+        for i in range(1, size + 1):
+            for j in range(i + 1, size + 1):
+                sheet['result{}{}'.format(i, j)] = 'V5'
+                sheet['result{}{}'.format(j, i)] = 'D{}'.format((i + j) % 5)
+        with count_queries() as stats:
+            response = self.client.post(pool_url, data=sheet)
+        self.assertEqual(response.status_code, 302)
+        self.assertWithinBudget('edit_pool', stats)
+        return stats.count
+
+    def test_edit_pool_is_flat_in_pool_size(self):
+        small = self.submit_sheet(self.seat_pool(4), 4)
+        large = self.submit_sheet(self.seat_pool(7), 7)
+        self.assertEqual(small, large)
+
+    def test_edit_registration_is_flat_in_teams(self):
+        counts = []
+        for num_teams in (3, 12):
+            event = self.register_teams(num_teams)
+            url = '/event/{}/registration/edit'.format(event.id)
+            with count_queries() as stats:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data.count(b'Alpha'), num_teams)
+            self.assertWithinBudget('edit_registration', stats)
+            counts.append(stats.count)
+        self.assertEqual(counts[0], counts[1])
+
+    def test_explore_is_flat_in_tournaments(self):
+        self.client.get('/logout')
+        counts = []
+        for _ in range(2):
+            db.session.add_all([Tournament(name='Open') for _ in range(10)])
+            db.session.commit()
+            with count_queries() as stats:
+                self.assertEqual(self.client.get('/explore').status_code, 200)
+            self.assertWithinBudget('explore', stats)
+            counts.append(stats.count)
+        self.assertEqual(counts[0], counts[1])
+
+
+if __name__ == "__main__":
+    unittest.main()
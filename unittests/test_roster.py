@@ -0,0 +1,88 @@
+import io
+import unittest
+
+from base import AppTestCase
+from app import app, db
+from app.instrumentation import count_queries
+from app.models import Club, Fencer, Stage, Team
+from app.roster import RosterError, import_teams, parse_roster
+
+
+def roster(*rows):
+    lines = ['team,club,fencer_a,fencer_b,fencer_c,fencer_d,checked_in'] + list(rows)
+    return io.BytesIO('\n'.join(lines).encode('utf-8'))
+
+
+class Roster(AppTestCase):
+
+    def post_roster(self, event, data):
+        return self.client.post(
+            '/event/{}/registration/import'.format(event.id),
+            data=dict(roster=(io.BytesIO(data.encode('utf-8')), 'roster.csv')),
+            content_type='multipart/form-data')
+
+    def test_rejected_rows(self):
+        with self.assertRaises(RosterError) as raised:
+            parse_roster(roster(
+                'Rice A,Rice,Ann Lee,Bob Ray,,,yes',
+                ',Rice,Ann Lee,Bob Ray,,,',
+                'Rice B,Nowhere,Ann Lee,Bob Ray,,,',
+                'Rice C,Rice,Ann Lee,,,,',
+                'Rice D,Rice,Ann Lee,Bob Ray2,,,',
+                'Rice A,Rice,Ann Lee,Bob Ray,,,',
+                'Rice E,Rice,Ann Lee,Bob Ray,,,maybe'), 'roster.csv')
+        self.assertEqual([line for line, message in raised.exception.errors],
+                         [3, 4, 5, 6, 7, 8])
+        self.assertIn('Rice A', raised.exception.errors[4][1])
+        with self.assertRaises(RosterError):
+            parse_roster(roster(), 'roster.csv')
+
+    def test_import_teams(self):
+        event = self.create_event(2, Stage.REGISTRATION_OPEN)
+        teams = parse_roster(roster(
+            'Rice A,Rice,ann lee,Bob Ray,Cat Kim,,yes',
+            'UH A,UH,Ann Lee,Bob Ray,,,no'), 'roster.csv')
+        import_teams(event, teams)
+        db.session.commit()
+        self.assertEqual(event.num_fencers, 4)
+        self.assertEqual(event.num_fencers_checked_in, 3)
+        team = event.teams.filter(Team.name == 'UH A').one()
+        self.assertFalse(team.is_checked_in)
+        self.assertEqual(team.club.name, 'UH')
+        slots = [(f.team_position, f.first_name, f.event_id)
+                 for f in team.fencers.order_by(Fencer.team_position.asc())]
+        self.assertEqual(slots, [('A', 'Ann', event.id), ('B', 'Bob', event.id),
+                                 ('C', '', None), ('D', '', None)])
+        team = event.teams.filter(Team.name == 'Rice A').one()
+        self.assertEqual(team.fencers.filter(Fencer.team_position == 'A').one().first_name, 'Ann')
+        self.assertEqual(team.fencers.filter(Fencer.team_position == 'C').one().last_name, 'Kim')
+
+    def test_import_with_every_club_new_is_within_budget(self):
+        event = self.create_event(0, Stage.REGISTRATION_OPEN)
+        clubs = app.config['UNIVERSITIES']
+        data = 'team,club,fencer_a,fencer_b\n' + ''.join(
+            '{0} A,{0},Ann Lee,Bob Ray\n'.format(club) for club in clubs)
+        with count_queries() as stats:
+            response = self.post_roster(event, data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Club.query.count(), len(clubs))
+        self.assertEqual(event.teams.count(), len(clubs))
+        self.assertLessEqual(stats.count, app.view_functions['import_registration'].query_budget)
+
+    def test_import_of_registered_name_writes_nothing(self):
+        event = self.create_event(1, Stage.REGISTRATION_OPEN)
+        response = self.post_roster(event, 'team,club,fencer_a,fencer_b\n'
+                                           'Rice A,Rice,Ann Lee,Bob Ray\n'
+                                           'Team 1,UH,Ann Lee,Bob Ray\n')
+        self.assertEqual(response.status_code, 302)
+        with self.client.session_transaction() as session:
+            flashes = [message for category, message in session['_flashes']]
+        self.assertIn('Team Team 1 is already registered.', flashes)
+        db.session.expire_all()
+        self.assertEqual(event.teams.count(), 1)
+        self.assertEqual(event.num_fencers, 1)
+        self.assertEqual(Fencer.query.count(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()